@@ -0,0 +1,56 @@
+import argparse
+import json
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare two benchmark results (see benchmarks/run.py).')
+    parser.add_argument('base', type=str,
+                        help='The JSON results of the baseline.')
+    parser.add_argument('new', type=str,
+                        help='The JSON results to compare with the baseline.')
+
+    return parser.parse_args()
+
+def load_results(file_name):
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+def compare(base, new):
+    """Compare the throughput and peak RSS of the benchmarks of two results.
+
+    Args:
+        base (dict): The baseline results.
+        new (dict): The new results.
+
+    Returns:
+        list: For each benchmark in both results, the name, the base and new files/s, the
+              speedup, and the base and new peak RSS in MB (None for a failed benchmark).
+    """
+
+    rows = []
+    for name, base_result in base['results'].items():
+        new_result = new['results'].get(name)
+        if new_result is None:
+            continue
+        base_fps = base_result.get('files_per_sec')
+        new_fps = new_result.get('files_per_sec')
+        speedup = new_fps / base_fps if base_fps and new_fps else None
+        rows.append([name, base_fps, new_fps, speedup,
+                     base_result.get('peak_rss_mb'), new_result.get('peak_rss_mb')])
+    return rows
+
+def format_value(value, fmt):
+    return 'failed' if value is None else fmt.format(value)
+
+if __name__ == '__main__':
+    args = get_args()
+    base, new = load_results(args.base), load_results(args.new)
+    for label, results in [('base', base), ('new', new)]:
+        print('{0}: {1} ({2})'.format(label, results['meta']['git_revision'], results['meta']['created']))
+
+    print('{0:<20} {1:>12} {2:>12} {3:>8} {4:>10} {5:>10}'.format(
+        'benchmark', 'base files/s', 'new files/s', 'speedup', 'base MB', 'new MB'))
+    for name, base_fps, new_fps, speedup, base_rss, new_rss in compare(base, new):
+        print('{0:<20} {1:>12} {2:>12} {3:>8} {4:>10} {5:>10}'.format(
+            name, format_value(base_fps, '{:.1f}'), format_value(new_fps, '{:.1f}'),
+            format_value(speedup, '{:.2f}x'), format_value(base_rss, '{:.1f}'),
+            format_value(new_rss, '{:.1f}')))
@@ -0,0 +1,114 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+import io
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+
+import utils.dataset
+from utils.dataset import iter_json_items
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Check that iter_json_items streams a coco file '
+                                                 'and compare it with json.load.')
+    parser.add_argument('--images', type=int, default=20000,
+                        help='Number of images in the synthetic coco file.')
+    parser.add_argument('--anns-per-image', type=int, default=8,
+                        help='Number of annotations of each image.')
+    parser.add_argument('--chunk-size', type=int, default=1 << 16,
+                        help='Number of characters read at a time.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed.')
+
+    return parser.parse_args()
+
+class CountingFile(io.TextIOWrapper):
+    """A text file that counts the characters read from it."""
+
+    chars_read = 0
+
+    def read(self, size=-1):
+        data = super(CountingFile, self).read(size)
+        CountingFile.chars_read += len(data)
+        return data
+
+def counting_open(path, mode='r'):
+    return CountingFile(open(path, 'rb'))
+
+def write_coco(json_path, n_images, anns_per_image, rng):
+    """Write a synthetic coco file with polygon annotations."""
+
+    images = [{'id': i, 'file_name': '{:012d}.jpg'.format(i), 'height': 480, 'width': 640}
+              for i in range(1, n_images + 1)]
+    annotations = []
+    for image in images:
+        for _ in range(anns_per_image):
+            x, y = rng.uniform(0, 600), rng.uniform(0, 440)
+            annotations.append({'id': len(annotations) + 1, 'image_id': image['id'],
+                                'category_id': rng.randint(1, 80), 'iscrowd': 0,
+                                'area': 1600.0, 'bbox': [x, y, 40.0, 40.0],
+                                'segmentation': [[rng.uniform(0, 640) for _ in range(16)]]})
+    coco = {'info': {'description': 'synthetic'}, 'images': images, 'annotations': annotations,
+            'categories': [{'id': i, 'name': 'cat{}'.format(i)} for i in range(1, 81)]}
+    with open(json_path, 'w') as f:
+        json.dump(coco, f)
+
+if __name__ == '__main__':
+    args = get_args()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, 'instances.json')
+        write_coco(json_path, args.images, args.anns_per_image, rng)
+        file_size = os.path.getsize(json_path)
+
+        # Only the first chunk (and the one after, if the first item is cut) may be
+        # read before the first item is yielded.
+        utils.dataset.open = counting_open
+        try:
+            items = iter_json_items(json_path, args.chunk_size)
+            next(items)
+            first_read = CountingFile.chars_read
+            items.close()
+        finally:
+            del utils.dataset.open
+        assert first_read <= 2 * args.chunk_size, \
+            '{0} characters read before the first item (chunk size {1}).'.format(first_read,
+                                                                                 args.chunk_size)
+
+        # Small chunks cut keys, numbers and literals at many positions.
+        with open(json_path, 'r') as f:
+            coco = json.load(f)
+        streamed = {}
+        for key, item in iter_json_items(json_path, 97):
+            if isinstance(coco[key], list):
+                streamed.setdefault(key, []).append(item)
+            else:
+                streamed[key] = item
+        assert streamed == coco
+        del coco, streamed
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        with open(json_path, 'r') as f:
+            json.load(f)
+        load_time = time.perf_counter() - start
+        load_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        for _ in iter_json_items(json_path, args.chunk_size):
+            pass
+        stream_time = time.perf_counter() - start
+        stream_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    mb = 1 << 20
+    print('File: {0:.1f} MB, read before the first item: {1:.1f} KB'.format(file_size / mb,
+                                                                            first_read / 1024))
+    print('json.load:       {0:.2f} s, peak {1:.1f} MB'.format(load_time, load_peak / mb))
+    print('iter_json_items: {0:.2f} s, peak {1:.1f} MB'.format(stream_time, stream_peak / mb))
@@ -0,0 +1,89 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+import timeit
+import numpy as np
+
+from utils.dataset import rle_decode
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the RLE decoder against the legacy implementation.')
+    parser.add_argument('--height', type=int, default=480, 
+                        help='Mask height.')
+    parser.add_argument('--width', type=int, default=640, 
+                        help='Mask width.')
+    parser.add_argument('--runs', type=int, default=2000, 
+                        help='Number of runs in each mask.')
+    parser.add_argument('--masks', type=int, default=20, 
+                        help='Number of random masks to decode.')
+    parser.add_argument('--repeat', type=int, default=3, 
+                        help='Number of timing repetitions.')
+    parser.add_argument('--seed', type=int, default=0, 
+                        help='Random seed.')
+
+    return parser.parse_args()
+
+def legacy_rle_decode(rle, shape):
+    """The original O(runs^2) decoder, kept as the reference implementation."""
+
+    mask = np.zeros([shape[0] * shape[1]], bool)
+    for idx, r in enumerate(rle):
+        s = 0 if idx < 1 else sum(rle[:idx])
+        e = s + r
+        if e == s:
+            continue
+        assert 0 <= s < mask.shape[0]
+        assert 1 <= e <= mask.shape[0], 'shape: {}  s {}  e {} r {}'.format(shape, s, e, r)
+        if idx % 2 == 1:
+            mask[s:e] = 1
+
+    # Reshape and transpose
+    mask = mask.reshape([shape[1], shape[0]]).T
+    return mask
+
+def random_counts(rng, shape, n_runs):
+    """Split the pixels of a mask into random runs.
+
+    Args:
+        rng (numpy.random.Generator): The random generator.
+        shape (list): The mask size as [height, width].
+        n_runs (int): The number of runs.
+
+    Returns:
+        list: The uncompressed run lengths.
+    """
+
+    n_pixels = shape[0] * shape[1]
+    cuts = np.sort(rng.choice(np.arange(1, n_pixels), n_runs - 1, replace=False))
+    counts = np.diff(np.concatenate([[0], cuts, [n_pixels]]))
+    return counts.tolist()
+
+if __name__ == '__main__':
+    args = get_args()
+    rng = np.random.default_rng(args.seed)
+    shape = [args.height, args.width]
+    rles = [random_counts(rng, shape, args.runs) for _ in range(args.masks)]
+
+    for rle in rles:
+        assert np.array_equal(rle_decode(rle, shape), legacy_rle_decode(rle, shape))
+    try:
+        import pycocotools.mask
+        for rle in rles:
+            compressed = pycocotools.mask.frPyObjects({'counts': rle, 'size': shape}, *shape)
+            assert np.array_equal(rle_decode(compressed['counts'], shape), 
+                                  pycocotools.mask.decode(compressed).astype(bool))
+    except ImportError:
+        print('pycocotools is not installed, skipping the compressed counts check.')
+
+    legacy = min(timeit.repeat(lambda: [legacy_rle_decode(rle, shape) for rle in rles], 
+                               number=1, repeat=args.repeat))
+    vectorized = min(timeit.repeat(lambda: [rle_decode(rle, shape) for rle in rles], 
+                                   number=1, repeat=args.repeat))
+    print('Masks: {0}, size: {1}x{2}, runs per mask: {3}'.format(args.masks, args.height, 
+                                                                 args.width, args.runs))
+    print('Legacy:     {:.2f} ms/mask'.format(legacy / args.masks * 1000))
+    print('Vectorized: {:.2f} ms/mask'.format(vectorized / args.masks * 1000))
+    print('Speedup:    {:.1f}x'.format(legacy / vectorized))
@@ -0,0 +1,206 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import subprocess
+import time
+
+from benchmarks.synthetic import make_coco, make_labelme, make_video, make_voc
+
+BENCHMARKS = ['voc2coco', 'labelme2coco', 'labelme2coco_viz', 'coco2labelme', 'coco_extract_cats', 
+              'video2images', 'convert_img']
+# Bumped when the synthetic data changes, so that existing data is made again.
+DATA_VERSION = 2
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the converters and image tools on synthetic data.')
+    parser.add_argument('--work-dir', type=str, default='./outputs/benchmarks',
+                        help='The directory of the synthetic data and outputs.')
+    parser.add_argument('--num-files', type=int, default=200,
+                        help='Number of images (annotation files) of each dataset.')
+    parser.add_argument('--img-size', type=int, nargs=2, default=[640, 480],
+                        help='The image width and height.')
+    parser.add_argument('--video-frames', type=int, default=250,
+                        help='Number of frames of the video.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The --workers of the tools.')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of runs of each benchmark, the fastest one is reported.')
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=BENCHMARKS, choices=BENCHMARKS,
+                        help='The benchmarks to run.')
+    parser.add_argument('--output', type=str, default='./outputs/benchmarks/results.json',
+                        help='The JSON file of the results.')
+
+    return parser.parse_args()
+
+def prepare_data(data_dir, num_files, img_size, video_frames):
+    """Make the synthetic datasets, unless they exist for the same parameters.
+
+    Args:
+        data_dir (str): The data directory.
+        num_files (int): Number of images of each dataset.
+        img_size (list): The image width and height.
+        video_frames (int): Number of frames of the video.
+
+    Returns:
+        dict: The paths of the datasets.
+    """
+
+    params = {'version': DATA_VERSION, 'num_files': num_files, 'img_size': list(img_size), 
+              'video_frames': video_frames}
+    data = {'voc': os.path.join(data_dir, 'voc'),
+            'labelme': os.path.join(data_dir, 'labelme'),
+            'coco': os.path.join(data_dir, 'coco'),
+            'video': os.path.join(data_dir, 'video', 'video.mp4')}
+    params_file = os.path.join(data_dir, 'params.json')
+    if os.path.exists(params_file):
+        with open(params_file, 'r') as f:
+            if json.load(f) == params:
+                return data
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+
+    print('Creating synthetic data in {}'.format(data_dir))
+    make_voc(data['voc'], num_files, img_size)
+    make_labelme(data['labelme'], num_files, img_size)
+    make_coco(data['coco'], 'bench', num_files, img_size)
+    make_video(data['video'], video_frames, img_size)
+    with open(params_file, 'w') as f:
+        json.dump(params, f)
+    return data
+
+def get_commands(data, out_dir, workers, num_files, video_frames):
+    """Get the command line and the number of input files of each benchmark."""
+
+    python = sys.executable
+    convert_img = ('import os, sys; sys.path.insert(0, {0!r}); from utils.image import convert_img; '
+                   'os.makedirs({2!r}); convert_img({1!r}, {2!r}, None, "png", workers={3})').format(
+                       parent_path, os.path.join(data['voc'], 'JPEGImages'),
+                       os.path.join(out_dir, 'convert_img'), workers)
+
+    return {
+        'voc2coco': ([python, 'dataset/voc2coco.py',
+                      '--images-dir', os.path.join(data['voc'], 'JPEGImages'),
+                      '--annotations-dir', os.path.join(data['voc'], 'Annotations'),
+                      '--output-dir', os.path.join(out_dir, 'voc2coco'),
+                      '--cat-file', os.path.join(data['voc'], 'category_names.txt'),
+                      '--workers', str(workers)], num_files),
+        'labelme2coco': ([python, 'dataset/labelme2coco.py',
+                          '--input-dir', data['labelme'],
+                          '--output-dir', os.path.join(out_dir, 'labelme2coco'),
+                          '--dataset-type', 'train',
+                          '--cat-file', os.path.join(data['labelme'], 'category_names.txt'),
+                          '--noviz',
+                          '--workers', str(workers)], num_files),
+        'labelme2coco_viz': ([python, 'dataset/labelme2coco.py',
+                              '--input-dir', data['labelme'],
+                              '--output-dir', os.path.join(out_dir, 'labelme2coco_viz'),
+                              '--dataset-type', 'train',
+                              '--cat-file', os.path.join(data['labelme'], 'category_names.txt'),
+                              '--workers', str(workers)], num_files),
+        'coco2labelme': ([python, 'dataset/coco2labelme.py',
+                          '--json-path', os.path.join(data['coco'], 'annotations', 'instances_bench.json'),
+                          '--img-dir', os.path.join(data['coco'], 'bench'),
+                          '--save-dir', os.path.join(out_dir, 'coco2labelme'),
+                          '--shape', 'polygon',
+                          '--workers', str(workers)], num_files),
+        'coco_extract_cats': ([python, 'dataset/coco_extract_cats.py',
+                               '--coco-dir', data['coco'],
+                               '--datasets', 'bench',
+                               '--category-names', 'person', 'car', 'dog',
+                               '--imgs-length', str(num_files),
+                               '--output-dir', os.path.join(out_dir, 'coco_extract_cats'),
+                               '--vis-dir', os.path.join(out_dir, 'coco_extract_cats', 'vis'),
+                               '--workers', str(workers)], num_files),
+        'video2images': ([python, 'image/video2images.py',
+                          '--video-source', data['video'],
+                          '--save-dir', os.path.join(out_dir, 'video2images')], video_frames),
+        'convert_img': ([python, '-c', convert_img], num_files),
+    }
+
+def run_command(cmd, log_file):
+    """Run a command and measure it.
+
+    Args:
+        cmd (list): The command line.
+        log_file (str): The file receiving the output of the command.
+
+    Returns:
+        tuple: The return code, the wall time in seconds and the peak RSS in MB of the
+               largest process (the command or one of its workers).
+    """
+
+    with open(log_file, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, cwd=parent_path, stdout=log, stderr=subprocess.STDOUT)
+        # The rusage of wait4 covers the process and its waited-for children (pool workers).
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return process.returncode, seconds, rusage.ru_maxrss * scale / (1 << 20)
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=parent_path,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    args = get_args()
+    data = prepare_data(os.path.join(args.work_dir, 'data'), args.num_files, args.img_size,
+                        args.video_frames)
+    out_dir = os.path.abspath(os.path.join(args.work_dir, 'out'))
+    data = {key: os.path.abspath(path) for key, path in data.items()}
+    commands = get_commands(data, out_dir, args.workers, args.num_files, args.video_frames)
+
+    results = {}
+    for name in args.benchmarks:
+        cmd, num_files = commands[name]
+        runs = []
+        for _ in range(args.repeat):
+            # The tools create their output directory (some refuse an existing one).
+            if os.path.exists(os.path.join(out_dir, name)):
+                shutil.rmtree(os.path.join(out_dir, name))
+            if not os.path.exists(out_dir):
+                os.makedirs(out_dir)
+            log_file = os.path.join(out_dir, '{}.log'.format(name))
+            returncode, seconds, peak_rss = run_command(cmd, log_file)
+            if returncode != 0:
+                print('{0} failed with code {1}, see {2}'.format(name, returncode, log_file))
+                break
+            runs.append({'seconds': seconds, 'peak_rss_mb': peak_rss})
+        if not runs:
+            results[name] = {'files': num_files, 'error': returncode}
+            continue
+
+        best = min(runs, key=lambda run: run['seconds'])
+        results[name] = {'files': num_files,
+                         'seconds': best['seconds'],
+                         'files_per_sec': num_files / best['seconds'],
+                         'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+                         'runs': runs}
+        print('{0:<20} {1:>8.2f} s {2:>10.1f} files/s {3:>8.1f} MB'.format(
+            name, best['seconds'], results[name]['files_per_sec'], results[name]['peak_rss_mb']))
+
+    report = {'meta': {'created': datetime.datetime.now().isoformat(),
+                       'git_revision': git_revision(),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpu_count': os.cpu_count()},
+              'config': vars(args),
+              'results': results}
+    if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+        os.makedirs(os.path.dirname(args.output))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results saved to {}'.format(args.output))
@@ -0,0 +1,85 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+import timeit
+import labelme
+import numpy as np
+import pycocotools.mask as mask_utils
+
+from dataset.labelme2coco import shape_to_rle
+
+SHAPE_TYPES = ['polygon', 'rectangle', 'circle', 'line', 'linestrip', 'point']
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare the banded labelme rasterizer with '
+                                                 'labelme.utils.shape_to_mask.')
+    parser.add_argument('--shapes', type=int, default=30000,
+                        help='Number of random shapes to compare.')
+    parser.add_argument('--max-size', type=int, default=640,
+                        help='Maximum image height and width.')
+    parser.add_argument('--timing-shapes', type=int, default=500,
+                        help='Number of shapes of each type to time.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed.')
+
+    return parser.parse_args()
+
+def random_shape(rng, img_size, shape_type):
+    """Draw a random labelme shape, possibly crossing the image borders.
+
+    Args:
+        rng (numpy.random.Generator): The random generator.
+        img_size (tuple): The image height and width.
+        shape_type (str): The labelme shape type.
+
+    Returns:
+        list: The shape points.
+    """
+
+    height, width = img_size
+    n_points = {'rectangle': 2, 'circle': 2, 'line': 2, 'point': 1}.get(shape_type,
+                                                                      int(rng.integers(3, 12)))
+    center = rng.uniform([-0.1 * width, -0.1 * height], [1.1 * width, 1.1 * height])
+    spread = rng.uniform(1, 0.5 * max(height, width))
+    points = center + rng.normal(0, spread, (n_points, 2))
+    # Mix fractional and integer coordinates, as in labelme files.
+    if rng.random() < 0.5:
+        points = np.round(points)
+    if shape_type == 'rectangle':
+        # Recent Pillow versions reject rectangles whose corners are not ordered.
+        points = np.sort(points, axis=0)
+    return points.tolist()
+
+def reference_rle(img_size, points, shape_type):
+    """The RLE of labelme.utils.shape_to_mask, rasterized on the full image."""
+
+    mask = labelme.utils.shape_to_mask(img_size, points, shape_type)
+    return mask_utils.encode(np.asfortranarray(mask.astype(np.uint8)))
+
+if __name__ == '__main__':
+    args = get_args()
+    rng = np.random.default_rng(args.seed)
+
+    for i in range(args.shapes):
+        img_size = tuple(int(v) for v in rng.integers(1, args.max_size + 1, 2))
+        shape_type = SHAPE_TYPES[i % len(SHAPE_TYPES)]
+        points = random_shape(rng, img_size, shape_type)
+        rle = shape_to_rle(img_size, points, shape_type)
+        expected = labelme.utils.shape_to_mask(img_size, points, shape_type)
+        assert np.array_equal(mask_utils.decode(rle).astype(bool), expected), \
+            'Masks differ for {0} {1} in an image of {2}.'.format(shape_type, points, img_size)
+    print('{} random shapes rasterized identically.'.format(args.shapes))
+
+    img_size = (args.max_size, args.max_size)
+    for shape_type in SHAPE_TYPES:
+        shapes = [random_shape(rng, img_size, shape_type) for _ in range(args.timing_shapes)]
+        reference = timeit.timeit(lambda: [reference_rle(img_size, points, shape_type)
+                                           for points in shapes], number=1)
+        banded = timeit.timeit(lambda: [shape_to_rle(img_size, points, shape_type)
+                                        for points in shapes], number=1)
+        print('{0:<10} shape_to_mask: {1:.3f} ms/shape, shape_to_rle: {2:.3f} ms/shape, '
+              'speedup: {3:.1f}x'.format(shape_type, reference / len(shapes) * 1000,
+                                         banded / len(shapes) * 1000, reference / banded))
@@ -0,0 +1,236 @@
+import base64
+import io
+import json
+import os
+import numpy as np
+import cv2
+from PIL import Image
+
+from utils.dataset import crop_to_rle
+
+CATEGORIES = ['person', 'car', 'dog']
+LABELME_SHAPE_TYPES = ['polygon', 'rectangle', 'circle', 'line', 'linestrip', 'point']
+
+def make_image(rng, width, height):
+    """Make a jpg-friendly synthetic image (a gradient with noise).
+
+    Args:
+        rng (numpy.random.Generator): The random generator.
+        width (int): The image width.
+        height (int): The image height.
+
+    Returns:
+        numpy.ndarray: The RGB image.
+    """
+
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = rng.uniform(0, 1, 3).astype(np.float32)
+    img = np.stack([x * base[0] + y * (1 - base[0]),
+                    x * (1 - base[1]) + y * base[1],
+                    (x + y) / 2 * base[2] + 64 * (1 - base[2])], axis=-1)
+    img += rng.normal(0, 8, (height, width, 1)).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def random_box(rng, width, height):
+    """Get a random box as [xmin, ymin, xmax, ymax], at least 2 pixels wide and high."""
+
+    w = int(rng.integers(width // 10, width // 3))
+    h = int(rng.integers(height // 10, height // 3))
+    x = int(rng.integers(1, width - w - 1))
+    y = int(rng.integers(1, height - h - 1))
+    return [x, y, x + w, y + h]
+
+def random_polygon(rng, box, n_points=8):
+    """Get a random star-shaped polygon inside a box as [[x, y], ...]."""
+
+    xmin, ymin, xmax, ymax = box
+    angles = np.sort(rng.uniform(0, 2 * np.pi, n_points))
+    radius = rng.uniform(0.5, 1, n_points)
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    xs = cx + np.cos(angles) * radius * (xmax - xmin) / 2
+    ys = cy + np.sin(angles) * radius * (ymax - ymin) / 2
+    return np.stack([xs, ys], axis=1).round(2).tolist()
+
+def random_shape(rng, box, shape_type):
+    """Get the labelme points of a random shape of the given type inside a box."""
+
+    xmin, ymin, xmax, ymax = box
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    if shape_type == 'polygon':
+        return random_polygon(rng, box)
+    if shape_type == 'rectangle':
+        return [box[:2], box[2:]]
+    if shape_type == 'circle':
+        return [[cx, cy], [cx + min(xmax - xmin, ymax - ymin) / 2, cy]]
+    if shape_type == 'line':
+        return [[xmin, ymin], [xmax, ymax]]
+    if shape_type == 'linestrip':
+        return random_polygon(rng, box, int(rng.integers(3, 6)))
+    return [[cx, cy]]
+
+def write_cat_file(file_name, labelme=False):
+    with open(file_name, 'w') as f:
+        if labelme:
+            f.write('__ignore__\n_background_\n')
+        f.write('\n'.join(CATEGORIES) + '\n')
+    return file_name
+
+def make_voc(out_dir, num_files, img_size=(640, 480), max_objects=4, seed=0):
+    """Make a synthetic voc dataset.
+
+    Args:
+        out_dir (str): The output directory (JPEGImages, Annotations and category_names.txt).
+        num_files (int): Number of images.
+        img_size (tuple, optional): The image (width, height). Defaults to (640, 480).
+        max_objects (int, optional): Maximum number of objects per image. Defaults to 4.
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+
+    rng = np.random.default_rng(seed)
+    width, height = img_size
+    for sub_dir in ['JPEGImages', 'Annotations']:
+        if not os.path.exists(os.path.join(out_dir, sub_dir)):
+            os.makedirs(os.path.join(out_dir, sub_dir))
+    write_cat_file(os.path.join(out_dir, 'category_names.txt'))
+
+    for i in range(num_files):
+        name = '{:06d}'.format(i)
+        Image.fromarray(make_image(rng, width, height)).save(
+            os.path.join(out_dir, 'JPEGImages', name + '.jpg'), quality=90)
+        objs = ''
+        for _ in range(int(rng.integers(1, max_objects + 1))):
+            xmin, ymin, xmax, ymax = random_box(rng, width, height)
+            objs += ('<object><name>{}</name><pose>Unspecified</pose><truncated>0</truncated>'
+                     '<difficult>0</difficult><bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax>'
+                     '<ymax>{}</ymax></bndbox></object>').format(
+                         CATEGORIES[int(rng.integers(len(CATEGORIES)))], xmin, ymin, xmax, ymax)
+        with open(os.path.join(out_dir, 'Annotations', name + '.xml'), 'w') as f:
+            f.write('<annotation><folder>VOC</folder><filename>{0}.jpg</filename><size>'
+                    '<width>{1}</width><height>{2}</height><depth>3</depth></size>'
+                    '<segmented>0</segmented>{3}</annotation>'.format(name, width, height, objs))
+
+def make_labelme(out_dir, num_files, img_size=(640, 480), max_shapes=4, seed=0):
+    """Make a synthetic labelme dataset, with the images embedded in the json files.
+
+    The shapes cycle through all the labelme shape types.
+
+    Args:
+        out_dir (str): The output directory (json files, images and category_names.txt).
+        num_files (int): Number of images.
+        img_size (tuple, optional): The image (width, height). Defaults to (640, 480).
+        max_shapes (int, optional): Maximum number of shapes per image. Defaults to 4.
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+
+    rng = np.random.default_rng(seed)
+    width, height = img_size
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    write_cat_file(os.path.join(out_dir, 'category_names.txt'), labelme=True)
+
+    for i in range(num_files):
+        name = '{:06d}'.format(i)
+        with io.BytesIO() as f:
+            Image.fromarray(make_image(rng, width, height)).save(f, format='JPEG', quality=90)
+            img_data = f.getvalue()
+        with open(os.path.join(out_dir, name + '.jpg'), 'wb') as f:
+            f.write(img_data)
+        shapes = []
+        for j in range(int(rng.integers(1, max_shapes + 1))):
+            box = random_box(rng, width, height)
+            shape_type = LABELME_SHAPE_TYPES[(i + j) % len(LABELME_SHAPE_TYPES)]
+            points = random_shape(rng, box, shape_type)
+            shapes.append({'label': CATEGORIES[int(rng.integers(len(CATEGORIES)))],
+                           'points': points,
+                           'group_id': None,
+                           'shape_type': shape_type,
+                           'flags': {}})
+        label = {'version': '5.2.1',
+                 'flags': {},
+                 'shapes': shapes,
+                 'imagePath': name + '.jpg',
+                 'imageData': base64.b64encode(img_data).decode('utf-8'),
+                 'imageHeight': height,
+                 'imageWidth': width}
+        with open(os.path.join(out_dir, name + '.json'), 'w') as f:
+            json.dump(label, f)
+
+def make_coco(coco_dir, dataset, num_files, img_size=(640, 480), max_objects=4, crowd_ratio=0.25,
+              seed=0):
+    """Make a synthetic coco dataset with polygon and RLE (crowd) masks.
+
+    Uses the layout of the coco release: coco_dir/annotations/instances_<dataset>.json
+    and the images in coco_dir/<dataset>.
+
+    Args:
+        coco_dir (str): The output directory.
+        dataset (str): The dataset name.
+        num_files (int): Number of images.
+        img_size (tuple, optional): The image (width, height). Defaults to (640, 480).
+        max_objects (int, optional): Maximum number of objects per image. Defaults to 4.
+        crowd_ratio (float, optional): The ratio of RLE (crowd) annotations. Defaults to 0.25.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        str: The annotation file.
+    """
+
+    rng = np.random.default_rng(seed)
+    width, height = img_size
+    img_dir = os.path.join(coco_dir, dataset)
+    ann_dir = os.path.join(coco_dir, 'annotations')
+    for sub_dir in [img_dir, ann_dir]:
+        if not os.path.exists(sub_dir):
+            os.makedirs(sub_dir)
+
+    images, annotations = [], []
+    for i in range(num_files):
+        file_name = '{:012d}.jpg'.format(i + 1)
+        Image.fromarray(make_image(rng, width, height)).save(os.path.join(img_dir, file_name),
+                                                              quality=90)
+        images.append({'id': i + 1, 'file_name': file_name, 'height': height, 'width': width})
+        for _ in range(int(rng.integers(1, max_objects + 1))):
+            box = random_box(rng, width, height)
+            polygon = random_polygon(rng, box)
+            xs, ys = [p[0] for p in polygon], [p[1] for p in polygon]
+            ann = {'id': len(annotations) + 1,
+                   'image_id': i + 1,
+                   'category_id': int(rng.integers(len(CATEGORIES))) + 1,
+                   'bbox': [min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)],
+                   'area': float((max(xs) - min(xs)) * (max(ys) - min(ys))),
+                   'iscrowd': 0,
+                   'segmentation': [[v for p in polygon for v in p]]}
+            if rng.uniform() < crowd_ratio:
+                mask = np.zeros([height, width], np.uint8)
+                cv2.fillPoly(mask, [np.round(polygon).astype(np.int32)], 1)
+                ann['iscrowd'] = 1
+                ann['segmentation'] = crop_to_rle(mask, 0, 0, [height, width])
+            annotations.append(ann)
+
+    categories = [{'supercategory': 'none', 'id': i + 1, 'name': name}
+                  for i, name in enumerate(CATEGORIES)]
+    ann_file = os.path.join(ann_dir, 'instances_{}.json'.format(dataset))
+    with open(ann_file, 'w') as f:
+        json.dump({'images': images, 'annotations': annotations, 'categories': categories}, f)
+    return ann_file
+
+def make_video(file_name, num_frames, img_size=(640, 480), fps=25, seed=0):
+    """Make a short synthetic video (a moving gradient).
+
+    Args:
+        file_name (str): The output video (.mp4).
+        num_frames (int): Number of frames.
+        img_size (tuple, optional): The frame (width, height). Defaults to (640, 480).
+        fps (int, optional): The frame rate. Defaults to 25.
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+
+    rng = np.random.default_rng(seed)
+    if not os.path.exists(os.path.dirname(file_name)):
+        os.makedirs(os.path.dirname(file_name))
+    img = make_image(rng, img_size[0], img_size[1])
+    writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*'mp4v'), fps, tuple(img_size))
+    for i in range(num_frames):
+        writer.write(np.roll(img, i * 4, axis=1))
+    writer.release()
@@ -4,10 +4,13 @@ parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
 import glob
-from tqdm import tqdm
 import argparse
 
-def get_args():
+from utils.lazy import lazy_import
+
+tqdm = lazy_import('tqdm')
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Batch rename files.')
     parser.add_argument('--file-dir', type=str, 
                         help='Directory of files.')
@@ -20,7 +23,7 @@ def get_args():
     parser.add_argument('--target-type', type=str, default='jpg', 
                         help='Only rename files that have the target type.')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 def rename_files(file_dir, save_dir, prefix, start_idx, target_type):
     """Batch rename files of given type.
@@ -36,7 +39,7 @@ def rename_files(file_dir, save_dir, prefix, start_idx, target_type):
     if save_dir is not None and not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
-    pbar = tqdm(glob.glob('{0}/*.{1}'.format(file_dir, target_type)))
+    pbar = tqdm.tqdm(glob.glob('{0}/*.{1}'.format(file_dir, target_type)))
     for i, file_path in enumerate(pbar):
         if save_dir is not None:
             dst_file_path = os.path.join(save_dir, 
@@ -49,6 +52,9 @@ def rename_files(file_dir, save_dir, prefix, start_idx, target_type):
         os.rename(file_path, dst_file_path)
         pbar.set_description('Renaming: {}'.format(dst_file_path))
     
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
     rename_files(args.file_dir, args.save_dir, args.prefix, args.start_idx, args.target_type)   
+
+if __name__ == '__main__':
+    main()
@@ -3,140 +3,182 @@ import sys
 parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
+import argparse
+import functools
 import json
-import subprocess
-import pandas as pd
-from utils.dataset import coco2shape
+from utils import profiler
+from utils.dataset import load_coco_index, coco2shape
+from utils.general import parallel_imap, materialize, MATERIALIZE_MODES
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert coco annotations to labelme format.')
+    parser.add_argument('--json-path', type=str, 
+                        help='The coco annotation file.')
+    parser.add_argument('--img-dir', type=str, 
+                        help='The directory of the coco images.')
+    parser.add_argument('--save-dir', type=str, 
+                        help='The output directory of labelme annotations (must not exist).')
+    parser.add_argument('--shape', type=str, default='rectangle', choices=['rectangle', 'polygon'], 
+                        help='The labelme shape type.')
+    parser.add_argument('--save-json-only', action='store_true', 
+                        help='Do not copy the images.')
+    parser.add_argument('--materialize', type=str, default='copy', choices=MATERIALIZE_MODES, 
+                        help='How to place the images in the save directory.')
+    parser.add_argument('--workers', type=int, default=1, 
+                        help='Number of worker processes.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
+
+    return parser.parse_args(argv)
+
+def build_record(file_name, height, width, labels, anns, shape='rectangle'):
+    """Build the labelme record of an image.
+
+    Args:
+        file_name (str): The image file name.
+        height (int): The image height.
+        width (int): The image width.
+        labels (list): The category name of each annotation.
+        anns (list): The coco annotations (utils.dataset.CocoAnnotation) of the image.
+        shape (str, optional): The labelme shape type (rectangle or polygon). Defaults to 'rectangle'.
+
+    Returns:
+        dict: The labelme record.
+    """
+
+    record = {
+        'imageData': None,
+        'fillColor': [255, 0, 0, 128],
+        'lineColor': [0, 255, 0, 128],
+        'imagePath': file_name,
+        'imageHeight': int(height),
+        'imageWidth': int(width),
+    }
+
+    if shape == 'rectangle':
+        # [x, y, w, h] -> [[x1, y1], [x2, y2]] for all annotations at once.
+        boxes = np.asarray([ann.bbox for ann in anns])
+        points = np.stack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1).tolist()
+        group_ids = [None] * len(anns)
+    elif shape == 'polygon':
+        rows = [(label, polygon, inst_idx) 
+                for inst_idx, (label, ann) in enumerate(zip(labels, anns)) 
+                for polygon in coco2shape(ann)]
+        labels, points, group_ids = zip(*rows) if rows else ((), (), ())
+
+    record['shapes'] = [{
+        'line_color': None,
+        'fill_color': None,
+        'shape_type': shape,
+        'label': label,
+        'group_id': group_id,
+        'points': polygon,
+    } for label, polygon, group_id in zip(labels, points, group_ids)]
+
+    return record
+
+def save_group(group, dirpath, imgpath, shape='rectangle', save_json_only=False, 
+               materialize_mode='copy'):
+    """Convert an image group and write its labelme file (and image).
+
+    Args:
+        group (tuple): The file name, height, width, labels and annotations of an image.
+        dirpath (str): The output directory of labelme annotations.
+        imgpath (str): The directory of the coco images.
+        shape (str, optional): The labelme shape type. Defaults to 'rectangle'.
+        save_json_only (bool, optional): Do not copy the image. Defaults to False.
+        materialize_mode (str, optional): How to place the image in the output directory 
+                                          (copy, hardlink, reflink or symlink). Defaults to 'copy'.
+
+    Returns:
+        str: The file name of the image.
+    """
+
+    file_name = group[0]
+    with profiler.stage('build_record'):
+        record = build_record(*group, shape=shape)
+    filename = os.path.basename(os.path.splitext(file_name)[0])
+    with profiler.stage('write_json'), open(os.path.join(dirpath, filename+'.json'), 'w') as jsonfile:
+        json.dump(record, jsonfile, ensure_ascii=True, indent=2)
+    if not save_json_only:
+        materialize(os.path.join(imgpath, file_name), 
+                    os.path.join(dirpath, os.path.basename(file_name)), 
+                    materialize_mode)
+
+    return file_name
 
 class CocoDatasetHandler:
     def __init__(self, jsonpath, imgpath, shape='rectangle'):
-        with open(jsonpath, 'r') as jsonfile:
-            ann = json.load(jsonfile)
         self.shape = shape
-        images = pd.DataFrame.from_dict(ann['images']).set_index('id')
-        annotations = pd.DataFrame.from_dict(ann['annotations']).set_index('id')
-        categories = pd.DataFrame.from_dict(ann['categories']).set_index('id')
-
-        annotations = annotations.merge(images, left_on='image_id', right_index=True)
-        annotations = annotations.merge(categories, left_on='category_id', right_index=True)
-        annotations = annotations.assign(
-            shapes=annotations.apply(self.coco2shape, axis=1))
-        self.annotations = annotations
-        
-        self.labelme = {}
+        # Rectangles only need the bounding boxes, so the segmentations are not kept.
+        self.images, self.categories, self.annotations = \
+            load_coco_index(jsonpath, keep_segmentation=shape == 'polygon')
 
         self.imgpath = imgpath
-        self.images = pd.DataFrame.from_dict(ann['images']).set_index('file_name')
-
-    def coco2shape(self, row):
-        if row.iscrowd == 1:
-            shapes = self.rle2shape(row)
-        elif row.iscrowd == 0:
-            shapes = self.polygon2shape(row)
-        return shapes
-
-    def rle2shape(self, row):
-        rle, shape = row['segmentation']['counts'], row['segmentation']['size']
-        mask = self._rle_decode(rle, shape)
-        padded_mask = np.zeros(
-            (mask.shape[0]+2, mask.shape[1]+2),
-            dtype=np.uint8,
-        )
-        padded_mask[1:-1, 1:-1] = mask
-        points = find_contours(mask, 0.5)
-        shapes = [
-            [[int(point[1]), int(point[0])] for point in polygon]
-            for polygon in points
-        ]
-        return shapes
-
-    def _rle_decode(self, rle, shape):
-        mask = np.zeros([shape[0] * shape[1]], np.bool)
-        for idx, r in enumerate(rle):
-            if idx < 1:
-                s = 0
-            else:
-                s = sum(rle[:idx])
-            e = s + r
-            if e == s:
+
+    def groups(self):
+        """Iterate over the annotated images in file name order.
+
+        Yields:
+            tuple: The file name, height, width, category names and annotations of an image.
+        """
+
+        groups = sorted((self.images[image_id][0], image_id) 
+                        for image_id in self.annotations if image_id in self.images)
+        for file_name, image_id in groups:
+            anns = [ann for ann in self.annotations[image_id] if ann.category_id in self.categories]
+            if not anns:
                 continue
-            assert 0 <= s < mask.shape[0]
-            assert 1 <= e <= mask.shape[0], "shape: {}  s {}  e {} r {}".format(shape, s, e, r)
-            if idx % 2 == 1:
-                mask[s:e] = 1
-        # Reshape and transpose
-        mask = mask.reshape([shape[1], shape[0]]).T
-        return mask
-
-    def polygon2shape(self, row):
-        # shapes: (n_polygons, n_points, 2)
-        if self.shape == 'polygon':
-            shapes = [
-                [[int(points[2*i]), int(points[2*i+1])] for i in range(len(points)//2)]
-                for points in row.segmentation
-            ]
-        elif self.shape == 'rectangle':
-            shapes = [[row.bbox[0], row.bbox[1]], [row.bbox[0]+row.bbox[2], row.bbox[1]+row.bbox[3]]]
-        return shapes
+            _, height, width = self.images[image_id]
+            labels = [self.categories[ann.category_id] for ann in anns]
+            yield file_name, height, width, labels, anns
 
     def coco2labelme(self):
-        fillColor = [255, 0, 0, 128]
-        lineColor = [0, 255, 0, 128]
-
-        groups = self.annotations.groupby('file_name')
-        for file_idx, (filename, df) in enumerate(groups):
-            print(filename)
-            record = {
-                'imageData': None,
-                'fillColor': fillColor,
-                'lineColor': lineColor,
-                'imagePath': filename,
-                'imageHeight': int(self.images.loc[filename].height),
-                'imageWidth': int(self.images.loc[filename].width),
-            }
-            record['shapes'] = []
-
-            instance = {
-                'line_color': None,
-                'fill_color': None,
-                'shape_type': self.shape,
-            }
-            for inst_idx, (_, row) in enumerate(df.iterrows()):
-                if self.shape == 'polygon':
-                    for polygon in row.shapes:
-                        copy_instance = instance.copy()
-                        copy_instance.update({
-                            'label': row['name'],
-                            'group_id': inst_idx,
-                            'points': polygon
-                        })
-                        record['shapes'].append(copy_instance)
-                elif self.shape == 'rectangle':
-                    copy_instance = instance.copy()
-                    copy_instance.update({
-                        'label': row['name'],
-                        'group_id': None,
-                        'points': row.shapes
-                    })
-                    record['shapes'].append(copy_instance)
-
-            if filename not in self.labelme.keys():
-                self.labelme[filename] = record
-
-    def save_labelme(self, file_names, dirpath, save_json_only=False):
+        """Iterate over the labelme records of the annotated images.
+
+        Yields:
+            tuple: The file name and the labelme record of an image.
+        """
+
+        for group in self.groups():
+            yield group[0], build_record(*group, shape=self.shape)
+
+    def save_labelme(self, dirpath, save_json_only=False, workers=1, materialize_mode='copy'):
+        """Convert all annotated images and write the labelme files.
+
+        Args:
+            dirpath (str): The output directory of labelme annotations (must not exist).
+            save_json_only (bool, optional): Do not copy the images. Defaults to False.
+            workers (int, optional): Number of worker processes. Defaults to 1.
+            materialize_mode (str, optional): How to place the images in the output directory 
+                                              (copy, hardlink, reflink or symlink). Defaults to 'copy'.
+        """
+
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
         else:
             raise ValueError(f"{dirpath} has existed")
 
-        for file in file_names:
-            filename = os.path.basename(os.path.splitext(file)[0])
-            with open(os.path.join(dirpath, filename+'.json'), 'w') as jsonfile:
-                json.dump(self.labelme[file], jsonfile, ensure_ascii=True, indent=2)
-            if not save_json_only:
-                subprocess.call(['cp', os.path.join(self.imgpath, file), dirpath])
+        worker = functools.partial(save_group, 
+                                   dirpath=dirpath, 
+                                   imgpath=self.imgpath, 
+                                   shape=self.shape, 
+                                   save_json_only=save_json_only, 
+                                   materialize_mode=materialize_mode)
+        for file_name in parallel_imap(worker, self.groups(), workers, chunksize=16):
+            print(file_name)
 
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
+    ds = CocoDatasetHandler(args.json_path, args.img_dir, args.shape)
+    ds.save_labelme(args.save_dir, args.save_json_only, args.workers, args.materialize)
+    if args.profile:
+        profiler.report(args.profile)
 
-ds = CocoDatasetHandler('/mnt/data/Dataset/safework/fukushima/FUKUSHIMA_coco/annotations/instances_val2020.json', '/mnt/data/Dataset/safework/fukushima/FUKUSHIMA_coco/val2020')
-ds.coco2labelme()
-ds.save_labelme(ds.labelme.keys(), '/mnt/data/Dataset/safework/fukushima/fukushima_labelme/val')
+if __name__ == '__main__':
+    main()
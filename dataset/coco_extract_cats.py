@@ -1,24 +1,36 @@
-from numpy import save
-from pycocotools.coco import COCO
 import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
 import argparse
-import shutil
-from tqdm import tqdm
-import skimage.io as io
-import matplotlib.pyplot as plt
-import cv2
-from PIL import Image, ImageDraw
-
-def get_args():
-    parser = argparse.ArgumentParser('Extract specified categories from COCO.')
+import collections
+import functools
+
+from utils import profiler
+from utils.coco_index import CocoIndex
+from utils.general import materialize, parallel_imap, MATERIALIZE_MODES
+from utils.lazy import lazy_import
+from utils.visualize import visualize_voc
+
+tqdm = lazy_import('tqdm')
+cv2 = lazy_import('cv2')
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Extract specified categories from COCO.')
     parser.add_argument('--coco-dir', type=str, default='./coco2014')
     parser.add_argument('--datasets', type=str, nargs='+', default=['train2014', 'val2014'])
     parser.add_argument('--category-names', type=str, nargs='+', default=['person', 'car'])
     parser.add_argument('--imgs-length', type=int, default=5000)
     parser.add_argument('--output-dir', type=str, default='./outputs')
     parser.add_argument('--vis-dir', type=str, default='./outputs/temp')
+    parser.add_argument('--vis-max-size', type=int)
+    parser.add_argument('--materialize', type=str, default='copy', choices=MATERIALIZE_MODES)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
@@ -64,42 +76,98 @@ tailstr = '''\
 '''
 
 def id2name(coco):
-    classes = dict()
-    for cls in coco.dataset['categories']:
-        classes[cls['id']] = cls['name']
-    return classes
+    return dict(zip(coco.cat_ids.tolist(), coco.cat_names))
+
+def get_objs(coco, img_ids, coco_clses, clses_ids, clses_names):
+    """Get the objects of the given categories in each image, with one query for all images.
 
-def get_objs(coco, img_id, coco_clses, clses_ids, clses_names):
-    ann_ids = coco.getAnnIds(imgIds=img_id, catIds=clses_ids, iscrowd=None)
-    anns = coco.loadAnns(ann_ids)
+    Returns:
+        dict: The [name, xmin, ymin, xmax, ymax] objects of each image id.
+    """
 
-    objs = []
+    anns = coco.load_anns(coco.get_ann_ids(img_ids=img_ids, cat_ids=clses_ids))
+
+    img_objs = collections.defaultdict(list)
     for ann in anns:
         cls_name = coco_clses[ann['category_id']]
         if cls_name in clses_names:
-            if 'bbox' in ann:
+            if ann['bbox'] is not None:
                 bbox = ann['bbox']
                 xmin = int(bbox[0])
                 ymin = int(bbox[1])
                 xmax = int(bbox[2] + bbox[0])
                 ymax = int(bbox[3] + bbox[1])
                 obj = [cls_name, xmin, ymin, xmax, ymax]
-                objs.append(obj)
-
-    return objs
-
-def save_anns(file_name, src_img_path, dst_img_path, dst_ann_path, objs):
-    shutil.copy(src_img_path, dst_img_path)
-    img = cv2.imread(src_img_path)
-    head = headstr % (file_name, img.shape[1], img.shape[0], img.shape[2])
-    with open(dst_ann_path, 'w') as f:
+                img_objs[ann['image_id']].append(obj)
+
+    return img_objs
+
+def plan_extraction(coco, clses_names, imgs_length):
+    """Select the images to extract for all categories at once.
+
+    The category-to-image index is built once, --imgs-length is applied per category, 
+    and the union of the selected images is returned so that an image containing 
+    several of the categories is processed only once.
+
+    Args:
+        coco (utils.coco_index.CocoIndex): The COCO dataset.
+        clses_names (list): The category names to extract.
+        imgs_length (int): The maximum number of images per category.
+
+    Returns:
+        tuple: The selected image ids (in first-selected order) and the selected image ids 
+               of each category.
+    """
+
+    name2id = dict(zip(coco.cat_names, coco.cat_ids.tolist()))
+    cls_img_ids = {}
+    for cls_name in clses_names:
+        if cls_name not in name2id:
+            print('Class: {} is not in the dataset, skipped.'.format(cls_name))
+            continue
+        # The images containing the category, in file order.
+        cls_img_ids[cls_name] = coco.get_img_ids(cat_ids=[name2id[cls_name]])[:imgs_length].tolist()
+
+    img_ids = list(dict.fromkeys(img_id for ids in cls_img_ids.values() for img_id in ids))
+
+    return img_ids, cls_img_ids
+
+def save_anns(file_name, src_img_path, dst_img_path, dst_ann_path, objs, materialize_mode='copy', 
+              img_shape=None):
+    materialize(src_img_path, dst_img_path, materialize_mode)
+    if img_shape is None:
+        img_shape = cv2.imread(src_img_path).shape
+    head = headstr % (file_name, img_shape[1], img_shape[0], img_shape[2])
+    with profiler.stage('write_xml'), open(dst_ann_path, 'w') as f:
         f.write(head)
         for obj in objs:
             f.write(objstr % (obj[0], obj[1], obj[2], obj[3], obj[4]))
         f.write(tailstr)
 
-if __name__ == '__main__':
-    args = get_args()
+def export_image(task, materialize_mode='copy'):
+    """Write the annotation and image of one COCO image.
+
+    The image size comes from the COCO metadata, so the image is not decoded.
+
+    Args:
+        task (tuple): file_name, img_path, dst_img_path, dst_ann_path, objs and img_shape 
+                      (height, width, depth).
+        materialize_mode (str, optional): How to place the image in the output directory. 
+                                          Defaults to 'copy'.
+
+    Returns:
+        str: The file name.
+    """
+
+    file_name, img_path, dst_img_path, dst_ann_path, objs, img_shape = task
+    save_anns(file_name, img_path, dst_img_path, dst_ann_path, objs, materialize_mode, img_shape)
+
+    return file_name
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
 
     for dataset in args.datasets:
         print('Processing dataset: {}'.format(dataset))
@@ -112,39 +180,43 @@ if __name__ == '__main__':
         if not os.path.exists(img_output_path):
             os.makedirs(img_output_path)
 
-        coco = COCO(ann_file)
+        coco = CocoIndex.load(ann_file)
         coco_clses = id2name(coco)
-        clses_ids = coco.getCatIds(catNms=args.category_names)
+        clses_ids = coco.get_cat_ids(args.category_names)
+        worker = functools.partial(export_image, materialize_mode=args.materialize)
         
-        for cls_name in args.category_names:
-            cls_id = coco.getCatIds(catNms=[cls_name])
-            img_ids = coco.getImgIds(catIds=cls_id)
-            img_ids = img_ids[:args.imgs_length] if len(img_ids) > args.imgs_length else img_ids
-            print('Class: {}, includes {} images.'.format(cls_name, len(img_ids)))
-            for img_id in tqdm(img_ids):
-                img = coco.loadImgs(img_id)[0]
-                file_name = img['file_name']
-                img_path = os.path.join(args.coco_dir, dataset, file_name)
-                objs = get_objs(coco, img_id, coco_clses, clses_ids, args.category_names)
-                if len(objs) == 0:
-                    continue
-                
-                dst_ann_path = os.path.join(ann_output_path, '{}.xml'.format(file_name[:-4]))
-                dst_img_path = os.path.join(img_output_path, file_name)
-                save_anns(file_name, img_path, dst_img_path, dst_ann_path, objs)
-
-                if args.vis_dir is not None:
-                    vis_path = os.path.join(args.vis_dir, dataset)
-                    if not os.path.exists(vis_path):
-                        os.makedirs(vis_path)
-                    vis_img_path = os.path.join(vis_path, 'vis_{}'.format(file_name))
-
-                    img = cv2.imread(img_path)
-                    for obj in objs:
-                        p1 = (obj[1], obj[2])
-                        p2 = (obj[3], obj[4])
-                        p3 = (max(obj[1], 15), max(obj[2], 15))
-                        cv2.rectangle(img, p1, p2, (0, 0, 255), 2)
-                        cv2.putText(img, obj[0], p3, cv2.FONT_ITALIC, 1, (0, 255, 0), 2)
-                    
-                    cv2.imwrite(vis_img_path, img)
\ No newline at end of file
+        img_ids, cls_img_ids = plan_extraction(coco, args.category_names, args.imgs_length)
+        for cls_name, ids in cls_img_ids.items():
+            print('Class: {}, includes {} images.'.format(cls_name, len(ids)))
+        print('Extracting {} unique images.'.format(len(img_ids)))
+
+        tasks = []
+        img_objs = get_objs(coco, img_ids, coco_clses, clses_ids, args.category_names)
+        for img in coco.load_imgs(img_ids):
+            file_name = img['file_name']
+            img_path = os.path.join(args.coco_dir, dataset, file_name)
+            objs = img_objs.get(img['id'], [])
+            if len(objs) == 0:
+                continue
+            
+            dst_ann_path = os.path.join(ann_output_path, '{}.xml'.format(file_name[:-4]))
+            dst_img_path = os.path.join(img_output_path, file_name)
+            # cv2.imread decodes to 3 channels, so the depth is always 3.
+            img_shape = (img['height'], img['width'], 3)
+            tasks.append((file_name, img_path, dst_img_path, dst_ann_path, objs, img_shape))
+
+        for _ in tqdm.tqdm(parallel_imap(worker, tasks, args.workers, chunksize=16), total=len(tasks)):
+            pass
+
+        if args.vis_dir is not None:
+            # Rendered from the written annotations, once the extraction is done.
+            xml_names = [os.path.basename(task[3]) for task in tasks]
+            visualize_voc(ann_output_path, img_output_path, os.path.join(args.vis_dir, dataset), 
+                          args.vis_max_size, workers=args.workers, prefix='vis_', 
+                          xml_names=xml_names)
+
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import argparse
+import base64
 import collections
 import datetime
+import functools
 import glob
 import json
 import os
@@ -9,18 +11,26 @@ parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
 import uuid
-import imgviz
-import numpy as np
-import labelme
-from PIL import Image
 
+from utils import profiler
+from utils.dataset import coco_shard_dir, crop_to_rle, open_coco_writer, runs_to_rle, COCO_OUTPUT_FORMATS
+from utils.general import parallel_imap, materialize, MATERIALIZE_MODES
+from utils.image import check_jpg
+from utils.lazy import lazy_import
+from utils.manifest import ConversionManifest, file_signature, remove_files
+from utils.visualize import visualize_coco
+
+imgviz = lazy_import('imgviz')
+np = lazy_import('numpy')
+labelme = lazy_import('labelme')
+Image = lazy_import('PIL.Image')
 try:
-    import pycocotools.mask
+    mask_utils = lazy_import('pycocotools.mask')
 except ImportError:
     print('Please install pycocotools:\n\n    pip install pycocotools\n')
     sys.exit(1)
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Convert labelme annotations to coco fomat.')
     parser.add_argument('--input-dir', type=str, 
                         help='The input directory of annotations.')
@@ -31,12 +41,248 @@ def get_args():
     parser.add_argument('--cat-file', type=str, 
                         help='The file containing the categories names.')
     parser.add_argument('--noviz', action='store_true', 
-                        help='No visualization.')
-    args = parser.parse_args()
+                        help='No visualization (it can be rendered later with dataset/visualize.py).')
+    parser.add_argument('--viz-max-size', type=int, 
+                        help='Shrink the visualizations so that their longest side is at most this size.')
+    parser.add_argument('--workers', type=int, default=1, 
+                        help='Number of worker processes.')
+    parser.add_argument('--materialize', type=str, default='copy', choices=MATERIALIZE_MODES, 
+                        help='How to place the source jpg images in the output directory.')
+    parser.add_argument('--incremental', action='store_true', 
+                        help='Only convert new or changed annotation files, reusing the cached results of the others.')
+    parser.add_argument('--output-format', type=str, default='json', choices=COCO_OUTPUT_FORMATS, 
+                        help='json writes one coco file, jsonl writes sharded JSON Lines.')
+    parser.add_argument('--shard-size', type=int, default=1000, 
+                        help='Number of images per shard (with --output-format jsonl).')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
+    args = parser.parse_args(argv)
 
     return args
 
-def convert_annotations(input_dir, output_dir, dataset_type, cat_file, noviz=False):
+def source_jpg_size(img_path, label_data):
+    """Get the size of the source image if it can be used as the output image as is.
+
+    That is the case for an intact RGB jpg image without EXIF rotation (labelme applies 
+    the orientation) whose size matches the annotation; grayscale and CMYK images are 
+    decoded, since the output images are RGB. Only the image header is read.
+
+    Args:
+        img_path (str): The image file the annotation refers to.
+        label_data (dict): The labelme annotation.
+
+    Returns:
+        tuple: The height and width, None if the image has to be decoded.
+    """
+
+    if not os.path.exists(img_path) or check_jpg(img_path) != 'ok':
+        return None
+    with Image.open(img_path) as img:
+        if img.getexif().get(0x0112, 1) != 1 or img.mode != 'RGB':
+            return None
+        width, height = img.size
+    if label_data.get('imageHeight', height) != height or label_data.get('imageWidth', width) != width:
+        return None
+    return height, width
+
+def load_label_image(img_path, label_data):
+    """Decode the image of a labelme annotation to RGB.
+
+    Args:
+        img_path (str): The image file the annotation refers to (None if not set).
+        label_data (dict): The labelme annotation.
+
+    Returns:
+        numpy.ndarray: The RGB image.
+    """
+
+    if label_data.get('imageData'):
+        img_data = base64.b64decode(label_data['imageData'])
+    elif img_path is not None and os.path.exists(img_path):
+        img_data = labelme.LabelFile.load_image_file(img_path)
+    else:
+        raise ValueError('No image data or image file for {}.'.format(img_path))
+    img = labelme.utils.img_data_to_arr(img_data)
+    if img.ndim == 2 or img.shape[2] != 3:
+        img = np.array(Image.fromarray(img).convert('RGB'))
+    return img
+
+def shape_to_rle(img_size, points, shape_type, line_width=10, point_size=5):
+    """Rasterize a labelme shape as COCO RLE.
+
+    Same mask as labelme.utils.shape_to_mask, but only the rows spanned by the shape 
+    (plus a margin for the outline and line width) are rasterized, and rectangles are 
+    encoded directly from their corners (the pixels PIL fills between the truncated 
+    coordinates). The band keeps the full width: PIL only uses y coordinates in 
+    differences, so shifting them is exact, while shifting x changes the rounding of 
+    edge crossings.
+
+    Args:
+        img_size (tuple): The image height and width.
+        points (list): The shape points.
+        shape_type (str): The labelme shape type.
+        line_width (int, optional): The width of lines. Defaults to 10.
+        point_size (int, optional): The radius of points. Defaults to 5.
+
+    Returns:
+        dict: The compressed RLE of the shape mask.
+    """
+
+    height, width = img_size
+    xy = np.asarray(points, dtype=float).reshape(-1, 2)
+    if shape_type == 'rectangle':
+        assert len(xy) == 2, 'Shape of shape_type=rectangle must have 2 points'
+        x0, x1 = sorted([int(x) for x in xy[:, 0]])
+        y0, y1 = sorted([int(y) for y in xy[:, 1]])
+        x0, x1 = max(x0, 0), min(x1, width - 1)
+        y0, y1 = max(y0, 0), min(y1, height - 1)
+        if x1 < x0 or y1 < y0:
+            rle = runs_to_rle([], [], img_size)
+        else:
+            starts = np.arange(x0, x1 + 1) * height + y0
+            rle = runs_to_rle(starts, starts + y1 - y0 + 1, img_size)
+        return mask_utils.frPyObjects(rle, height, width)
+
+    if shape_type == 'circle':
+        (cx, cy), (px, py) = xy
+        radius = np.hypot(cx - px, cy - py)
+        low, high = [cx - radius, cy - radius], [cx + radius, cy + radius]
+    elif shape_type == 'point':
+        (cx, cy), = xy
+        low, high = [cx - point_size, cy - point_size], [cx + point_size, cy + point_size]
+    else:
+        low, high = xy.min(axis=0), xy.max(axis=0)
+    margin = 2 + (line_width if shape_type in ['line', 'linestrip'] else 0)
+    y0 = min(max(int(np.floor(low[1])) - margin, 0), height)
+    y1 = max(min(int(np.ceil(high[1])) + margin + 1, height), y0)
+
+    crop = labelme.utils.shape_to_mask((y1 - y0, width), (xy - [0, y0]).tolist(), shape_type, 
+                                       line_width, point_size)
+    rle = crop_to_rle(crop, 0, y0, img_size)
+    return mask_utils.frPyObjects(rle, height, width)
+
+def convert_label_file(filename, output_dir, dataset_type, out_ann_file, cat_ids, sign=False, 
+                       materialize_mode='copy', with_masks=False):
+    """Convert a single labelme annotation file.
+
+    Writes the image to the output directory and returns the coco records without ids, 
+    so that the caller can number them in input order.
+
+    When imagePath refers to a usable jpg image (see source_jpg_size), its bytes are 
+    copied or linked without decoding; otherwise the embedded imageData (or the image 
+    file) is decoded and saved as jpg.
+
+    Args:
+        filename (str): The labelme annotation file.
+        output_dir (str): The output directory of coco format annotations.
+        dataset_type (str): The dataset type (train or val or test).
+        out_ann_file (str): The coco annotation file the image paths are relative to.
+        cat_ids (dict): The category names and ids.
+        sign (bool, optional): Also return the signature of the annotation file and the image 
+                               file it refers to (see utils.manifest.file_signature). 
+                               Defaults to False.
+        materialize_mode (str, optional): How to place a source jpg image in the output 
+                                          directory. Defaults to 'copy'.
+        with_masks (bool, optional): Also return the mask of each annotation as compressed 
+                                     RLE, for the visualization (the segmentation of circles, 
+                                     lines and points is their labelme points). Defaults to False.
+
+    Returns:
+        tuple: The image record and the list of annotation records (then the masks and the 
+               signature, if requested).
+    """
+
+    with profiler.stage('read_json') as st:
+        with open(filename, 'r') as f:
+            label_data = json.load(f)
+            if st:
+                st.add_bytes(f.tell())
+    img_path = None
+    if label_data.get('imagePath'):
+        img_path = os.path.join(os.path.dirname(filename), label_data['imagePath'])
+
+    base = os.path.splitext(os.path.basename(filename))[0]
+    out_img_file = os.path.join(output_dir, dataset_type, base + '.jpg')
+
+    img_size = source_jpg_size(img_path, label_data) if img_path is not None else None
+    if img_size is not None:
+        materialize(img_path, out_img_file, materialize_mode)
+    else:
+        with profiler.stage('decode_image'):
+            img = load_label_image(img_path, label_data)
+        # Do not write through a link materialized by a previous run.
+        if os.path.lexists(out_img_file):
+            os.remove(out_img_file)
+        with profiler.stage('encode_image', img.nbytes):
+            imgviz.io.imsave(out_img_file, img)
+        img_size = img.shape[:2]
+    image = dict(license=0,
+                 url=None,
+                 file_name=os.path.relpath(out_img_file, 
+                                           os.path.dirname(out_ann_file)),
+                 height=img_size[0],
+                 width=img_size[1],
+                 date_captured=None,)
+
+    rles = collections.defaultdict(list)  # for area
+    segmentations = collections.defaultdict(list)  # for segmentation
+    for shape in label_data['shapes']:
+        points = shape['points']
+        label = shape['label']
+        group_id = shape.get('group_id')
+        shape_type = shape.get('shape_type', 'polygon')
+
+        if group_id is None:
+            group_id = uuid.uuid1()
+
+        instance = (label, group_id)
+
+        if label in cat_ids:
+            with profiler.stage('rasterize'):
+                rles[instance].append(shape_to_rle(img_size, points, shape_type))
+
+        if shape_type == 'rectangle':
+            (x1, y1), (x2, y2) = points
+            x1, x2 = sorted([x1, x2])
+            y1, y2 = sorted([y1, y2])
+            points = [x1, y1, x2, y1, x2, y2, x1, y2]
+        else:
+            points = np.asarray(points).flatten().tolist()
+
+        segmentations[instance].append(points)
+    segmentations = dict(segmentations)
+
+    annotations = []
+    masks = []
+    for instance, shape_rles in rles.items():
+        cat_name, group_id = instance
+        cat_id = cat_ids[cat_name]
+
+        with profiler.stage('rle_encode'):
+            mask = mask_utils.merge(shape_rles)
+            area = float(mask_utils.area(mask))
+            bbox = mask_utils.toBbox(mask).flatten().tolist()
+
+        annotations.append(dict(category_id=cat_id,
+                                segmentation=[] if shape_type == 'rectangle' else segmentations[instance],
+                                area=area,
+                                bbox=bbox,
+                                iscrowd=0,))
+        masks.append(mask)
+
+    result = (image, annotations)
+    if with_masks:
+        result += (masks,)
+    if sign:
+        paths = [filename]
+        if img_path is not None and os.path.exists(img_path):
+            paths.append(img_path)
+        result += (file_signature(paths),)
+    return result
+
+def convert_annotations(input_dir, output_dir, dataset_type, cat_file, noviz=False, workers=1, 
+                        incremental=False, materialize_mode='copy', viz_max_size=None, 
+                        output_format='json', shard_size=1000):
     """Convert labelme annotations to coco fomat.
 
     Args:
@@ -45,6 +291,20 @@ def convert_annotations(input_dir, output_dir, dataset_type, cat_file, noviz=Fal
         dataset_type (str): The dataset type (train or val or test).
         cat_file (str): The file containing the categories names.
         noviz (bool, optional): No visualization. Defaults to False.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        incremental (bool, optional): Only convert the new or changed annotation files and 
+                                      take the others from the cache in 
+                                      output_dir/.cache/dataset_type (see 
+                                      utils.manifest.ConversionManifest). Defaults to False.
+        materialize_mode (str, optional): How to place the source jpg images in the output 
+                                          directory (copy, hardlink, reflink or symlink). 
+                                          Defaults to 'copy'.
+        viz_max_size (int, optional): The maximum width and height of the visualizations. 
+                                      Defaults to None (original size).
+        output_format (str, optional): 'json' for output_dir/dataset_type.json or 'jsonl' for 
+                                       sharded JSON Lines in output_dir/dataset_type.shards (see 
+                                       utils.dataset.CocoShardWriter). Defaults to 'json'.
+        shard_size (int, optional): Number of images per shard. Defaults to 1000.
     """    
 
     if not os.path.exists(output_dir):
@@ -55,23 +315,23 @@ def convert_annotations(input_dir, output_dir, dataset_type, cat_file, noviz=Fal
 
     now = datetime.datetime.now()
 
-    data = dict(info=dict(description=None,
-                          url=None,
-                          version=None,
-                          year=now.year,
-                          contributor=None,
-                          date_created=now.strftime('%Y-%m-%d %H:%M:%S.%f'),),
-                licenses=[dict(url=None, id=0, name=None,)],
-                images=[
-                        # license, url, file_name, height, width, date_captured, id
-                       ],
-                type='instances',
-                annotations=[
-                             # segmentation, area, iscrowd, image_id, bbox, category_id, id
-                            ],
-                categories=[
-                            # supercategory, id, name
-                           ],)
+    fields = dict(info=dict(description=None,
+                            url=None,
+                            version=None,
+                            year=now.year,
+                            contributor=None,
+                            date_created=now.strftime('%Y-%m-%d %H:%M:%S.%f'),),
+                  licenses=[dict(url=None, id=0, name=None,)],
+                  images=[
+                          # license, url, file_name, height, width, date_captured, id
+                         ],
+                  type='instances',
+                  annotations=[
+                               # segmentation, area, iscrowd, image_id, bbox, category_id, id
+                              ],
+                  categories=[
+                              # supercategory, id, name
+                             ],)
     
     cat_ids = {}
     for i, line in enumerate(open(cat_file).readlines()):
@@ -81,108 +341,98 @@ def convert_annotations(input_dir, output_dir, dataset_type, cat_file, noviz=Fal
             assert cat_name == '__ignore__'
             continue
         cat_ids[cat_name] = cat_id
-        data['categories'].append(dict(supercategory=None, 
-                                       id=cat_id, 
-                                       name=cat_name,))
+        fields['categories'].append(dict(supercategory=None, 
+                                         id=cat_id, 
+                                         name=cat_name,))
     
     out_ann_file = os.path.join(output_dir, '{}.json'.format(dataset_type))
-    for img_id, filename in enumerate(glob.glob(os.path.join(input_dir, '*.json'))):
-        print('Generating dataset from: ', filename)
-
-        label_file = labelme.LabelFile(filename=filename)
-
-        base = os.path.splitext(os.path.basename(filename))[0]
-        out_img_file = os.path.join(output_dir, dataset_type, base + '.jpg')
-
-        img = labelme.utils.img_data_to_arr(label_file.imageData)
-        if img.shape[2] == 4: 
-            #img = img[:, :, :3]
-            img = Image.fromarray(img)
-            img = img.convert('RGB')
-            img = np.array(img)
-        imgviz.io.imsave(out_img_file, img)
-        data['images'].append(dict(license=0,
-                                   url=None,
-                                   file_name=os.path.relpath(out_img_file, 
-                                                             os.path.dirname(out_ann_file)),
-                                   height=img.shape[0],
-                                   width=img.shape[1],
-                                   date_captured=None,
-                                   id=img_id,))
-
-        masks = {}  # for area
-        segmentations = collections.defaultdict(list)  # for segmentation
-        for shape in label_file.shapes:
-            points = shape['points']
-            label = shape['label']
-            group_id = shape.get('group_id')
-            shape_type = shape.get('shape_type', 'polygon')
-            mask = labelme.utils.shape_to_mask(img.shape[:2], points, shape_type)
-
-            if group_id is None:
-                group_id = uuid.uuid1()
-
-            instance = (label, group_id)
-
-            if instance in masks:
-                masks[instance] = masks[instance] | mask
-            else:
-                masks[instance] = mask
+    filenames = glob.glob(os.path.join(input_dir, '*.json'))
+
+    manifest = None
+    changed_filenames = filenames
+    if incremental:
+        config = dict(input_dir=os.path.abspath(input_dir), 
+                      dataset_type=dataset_type, 
+                      categories=fields['categories'], 
+                      noviz=noviz, 
+                      materialize_mode=materialize_mode)
+        manifest = ConversionManifest(os.path.join(output_dir, '.cache', dataset_type), config)
+        keys = [os.path.basename(filename) for filename in filenames]
+        remove_files(manifest.remove_missing(keys))
+        changed_filenames = [filename for filename, key in zip(filenames, keys) 
+                             if not manifest.is_current(key)]
+        print('{0} of {1} annotation files are new or changed.'.format(len(changed_filenames), 
+                                                                       len(filenames)))
 
-            if shape_type == 'rectangle':
-                (x1, y1), (x2, y2) = points
-                x1, x2 = sorted([x1, x2])
-                y1, y2 = sorted([y1, y2])
-                points = [x1, y1, x2, y1, x2, y2, x1, y2]
+    worker = functools.partial(convert_label_file, 
+                               output_dir=output_dir, 
+                               dataset_type=dataset_type, 
+                               out_ann_file=out_ann_file, 
+                               cat_ids=cat_ids, 
+                               sign=incremental, 
+                               materialize_mode=materialize_mode, 
+                               with_masks=not noviz)
+    # Results come in the order of changed_filenames, a subsequence of filenames.
+    results = parallel_imap(worker, changed_filenames, workers)
+    changed_filenames = set(changed_filenames)
+    # The rasterized masks of the converted images ({file_name: [rle]}), to be visualized.
+    viz_masks = {}
+    with open_coco_writer(out_ann_file, fields, output_format, shard_size) as writer:
+        for img_id, filename in enumerate(filenames):
+            if manifest is None or filename in changed_filenames:
+                print('Generating dataset from: ', filename)
+                result = next(results)
+                image, annotations = result[:2]
+                if not noviz:
+                    viz_masks[image['file_name']] = result[2]
+                if manifest is not None:
+                    key = os.path.basename(filename)
+                    img_id = manifest.assign_id(key)
+                    base = os.path.splitext(key)[0]
+                    outputs = [os.path.join(output_dir, dataset_type, base + '.jpg')]
+                    if not noviz:
+                        outputs.append(os.path.join(output_dir, 'Visualization', base + '.jpg'))
+                    manifest.update(key, result[-1], dict(image=image, annotations=annotations), 
+                                    img_id, outputs)
             else:
-                points = np.asarray(points).flatten().tolist()
-
-            segmentations[instance].append(points)
-        segmentations = dict(segmentations)
-
-        for instance, mask in masks.items():
-            cat_name, group_id = instance
-            if cat_name not in cat_ids:
-                continue
-            cat_id = cat_ids[cat_name]
-
-            mask = np.asfortranarray(mask.astype(np.uint8))
-            mask = pycocotools.mask.encode(mask)
-            area = float(pycocotools.mask.area(mask))
-            bbox = pycocotools.mask.toBbox(mask).flatten().tolist()
-
-            data['annotations'].append(dict(id=len(data['annotations']),
-                                            image_id=img_id,
-                                            category_id=cat_id,
-                                            segmentation=[] if shape_type == 'rectangle' else segmentations[instance],
-                                            area=area,
-                                            bbox=bbox,
-                                            iscrowd=0,))
-
-        if not noviz:
-            labels, captions, masks = zip(
-                *[
-                    (cat_ids[cnm], cnm, msk)
-                    for (cnm, gid), msk in masks.items()
-                    if cnm in cat_ids
-                ]
-            )
-            viz = imgviz.instances2rgb(image=img,
-                                       labels=labels,
-                                       masks=masks,
-                                       captions=captions,
-                                       font_size=15,
-                                       line_width=2,)
-            out_viz_file = os.path.join(output_dir, 'Visualization', base + '.jpg')
-            imgviz.io.imsave(out_viz_file, viz)
-
-    with open(out_ann_file, 'w') as f:
-        json.dump(data, f)
+                key = os.path.basename(filename)
+                fragment = manifest.load_fragment(key)
+                image, annotations = fragment['image'], fragment['annotations']
+                img_id = manifest.get(key)['id']
 
-if __name__ == '__main__':
-    args = get_args()
+            image['id'] = img_id
+            first_id = writer.counts['annotations']
+            writer.add_record(image, [dict(id=first_id + i,
+                                           image_id=img_id,
+                                           **ann) for i, ann in enumerate(annotations)])
+
+    if not noviz:
+        # Rendered from the written annotations, so the conversion does not wait for it, 
+        # with the rasterized masks (only the converted images are rendered).
+        written = out_ann_file if output_format == 'json' else coco_shard_dir(out_ann_file)
+        visualize_coco(written, output_dir, os.path.join(output_dir, 'Visualization'), 
+                       viz_max_size, workers=workers, file_names=set(viz_masks), masks=viz_masks)
+
+    if manifest is not None:
+        manifest.save()
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
     convert_annotations(args.input_dir, 
                         args.output_dir, 
                         args.dataset_type, 
                         args.cat_file,
-                        args.noviz)
\ No newline at end of file
+                        args.noviz,
+                        args.workers,
+                        args.incremental,
+                        args.materialize,
+                        args.viz_max_size,
+                        args.output_format,
+                        args.shard_size)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
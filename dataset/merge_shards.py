@@ -0,0 +1,37 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+
+from utils import profiler
+from utils.dataset import merge_coco_shards
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Concatenate sharded COCO JSON Lines into a COCO file.')
+    parser.add_argument('--shard-dir', type=str, 
+                        help='The directory of shards (e.g. instances_train.shards).')
+    parser.add_argument('--output', type=str, 
+                        help='The COCO annotation file to write (defaults to the shard directory '
+                             'with a .json extension, e.g. instances_train.json).')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
+
+    shard_dir = os.path.normpath(args.shard_dir)
+    output = args.output or os.path.splitext(shard_dir)[0] + '.json'
+    counts = merge_coco_shards(shard_dir, output)
+    print('Merged {0} images and {1} annotations into {2}.'.format(counts['images'], 
+                                                                 counts['annotations'], output))
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
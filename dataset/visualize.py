@@ -0,0 +1,57 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+
+from utils import profiler
+from utils.visualize import visualize_coco, visualize_voc
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render previews of converted coco or voc annotations.')
+    parser.add_argument('--coco-json', type=str,
+                        help='The coco annotation file or directory of shards (or use --voc-ann-dir).')
+    parser.add_argument('--voc-ann-dir', type=str,
+                        help='The directory of voc annotation files.')
+    parser.add_argument('--img-dir', type=str,
+                        help='The image directory (defaults to the directory of --coco-json).')
+    parser.add_argument('--save-dir', type=str,
+                        help='The output directory of the previews.')
+    parser.add_argument('--max-size', type=int,
+                        help='Shrink the previews so that their longest side is at most this size.')
+    parser.add_argument('--num-samples', type=int,
+                        help='Only render a random subset of this many images.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the sampling.')
+    parser.add_argument('--prefix', type=str, default='',
+                        help='The prefix of the preview file names.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json',
+                        help='Print the time spent in each stage and save it to this JSON file.')
+
+    args = parser.parse_args(argv)
+
+    return args
+
+def main(argv=None):
+    args = get_args(argv)
+    if (args.coco_json is None) == (args.voc_ann_dir is None):
+        raise ValueError('Specify one of --coco-json and --voc-ann-dir.')
+    if args.profile:
+        profiler.enable()
+
+    if args.coco_json is not None:
+        img_dir = args.img_dir or os.path.dirname(args.coco_json)
+        save_paths = visualize_coco(args.coco_json, img_dir, args.save_dir, args.max_size,
+                                    args.num_samples, args.seed, args.workers, args.prefix)
+    else:
+        save_paths = visualize_voc(args.voc_ann_dir, args.img_dir, args.save_dir, args.max_size,
+                                   args.num_samples, args.seed, args.workers, args.prefix)
+    print('Rendered {0} previews to {1}.'.format(len(save_paths), args.save_dir))
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,16 @@ parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
 import argparse
-import json
-import xml.etree.ElementTree as ET
-import shutil
+import functools
 
-from utils.general import get_xml_elements
-from utils.dataset import get_dataset_type, get_category_ids
-from utils.image import is_jpg
+from utils import profiler
+from utils.general import parallel_imap, materialize, MATERIALIZE_MODES
+from utils.dataset import get_dataset_type, get_category_ids, parse_voc_xml, open_coco_writer, COCO_OUTPUT_FORMATS
+from utils.image import check_jpg, validate_images
+from utils.manifest import ConversionManifest, file_signature, remove_files
 
-def get_args():
-    parser = argparse.ArgumentParser('Convert dataset from voc format to coco format.')
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert dataset from voc format to coco format.')
     parser.add_argument('--start-id', type=int, default=1, 
                         help='start bounding box index.')
     parser.add_argument('--images-dir', type=str, 
@@ -26,13 +26,99 @@ def get_args():
                         help='The file containing the categories names.')
     parser.add_argument('--split-ratio', nargs=3, type=int, default=[80, 10, 10], 
                         help='split ration of train/val/test dataset') 
+    parser.add_argument('--workers', type=int, default=1, 
+                        help='Number of worker processes parsing the annotations.')
+    parser.add_argument('--materialize', type=str, default='copy', choices=MATERIALIZE_MODES, 
+                        help='How to place the images in the output directory.')
+    parser.add_argument('--validate-images', action='store_true', 
+                        help='Check all images in the image directory up front and report the bad ones.')
+    parser.add_argument('--incremental', action='store_true', 
+                        help='Only convert new or changed annotation files, reusing the cached results of the others.')
+    parser.add_argument('--output-format', type=str, default='json', choices=COCO_OUTPUT_FORMATS, 
+                        help='json writes one coco file per split, jsonl writes sharded JSON Lines.')
+    parser.add_argument('--shard-size', type=int, default=1000, 
+                        help='Number of images per shard (with --output-format jsonl).')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
+def read_annotation(xml_path, images_dir, cat_names, check_image=True, sign=False):
+    """Parse a voc annotation file and check its image before anything is copied.
+
+    Args:
+        xml_path (str): The voc annotation file.
+        images_dir (str): The input directory of images.
+        cat_names (list): The category names to keep.
+        check_image (bool, optional): Check the image header (see utils.image.check_jpg). 
+                                      Defaults to True.
+        sign (bool, optional): Add the 'signature' of the annotation and image files 
+                               (see utils.manifest.file_signature). Defaults to False.
+
+    Returns:
+        dict: The parsed annotation with the objects of the kept categories only and 
+              the 'image_status' of the image (None if not checked).
+    """
+
+    voc = parse_voc_xml(xml_path)
+    voc['objects'] = [obj for obj in voc['objects'] if obj[0] in cat_names]
+    voc['image_status'] = None
+    if check_image and len(voc['objects']) > 0:
+        voc['image_status'] = check_jpg(os.path.join(images_dir, voc['filename']))
+    if sign:
+        paths = [xml_path]
+        if voc['filename'] is not None:
+            paths.append(os.path.join(images_dir, voc['filename']))
+        voc['signature'] = file_signature(paths)
+
+    return voc
+
+def build_records(voc, xml_path, image_id, cat_ids):
+    """Build the coco records of a parsed voc annotation.
+
+    Args:
+        voc (dict): The parsed annotation (see read_annotation).
+        xml_path (str): The voc annotation file.
+        image_id (int): The image id.
+        cat_ids (dict): The category names and ids.
+
+    Returns:
+        tuple: The image record and the list of annotation records, whose ids are 
+               left to the caller.
+    """
+
+    annotations = []
+    for cat_name, xmin, ymin, xmax, ymax in voc['objects']:
+        category_id = cat_ids[cat_name]
+        xmin -= 1
+        ymin -= 1
+        assert(xmax > xmin)
+        assert(ymax > ymin)
+        o_width = abs(xmax - xmin)
+        o_height = abs(ymax - ymin)
+        annotations.append({'area': o_width*o_height, 
+                            'iscrowd': 0, 
+                            'image_id': image_id, 
+                            'bbox':[xmin, ymin, o_width, o_height],
+                            'category_id': category_id, 
+                            'id': None, 
+                            'ignore': 0,
+                            'segmentation': []})
+
+    if voc['width'] is None or voc['height'] is None:
+        raise NotImplementedError('Can not find size in {}.'.format(xml_path))
+    image = {'file_name': '{}.jpg'.format(image_id), 
+             'height': voc['height'], 
+             'width': voc['width'],
+             'id':image_id}
+
+    return image, annotations
+
 def convert_annotations(start_id, images_dir, annotations_dir, 
-                        output_dir, cat_file, split_ratio):
+                        output_dir, cat_file, split_ratio, workers=1, materialize_mode='copy', 
+                        validate=False, incremental=False, output_format='json', shard_size=1000):
     """Convert voc annotations to coco fomat.
 
     Args:
@@ -42,112 +128,136 @@ def convert_annotations(start_id, images_dir, annotations_dir,
         output_dir (str): The output directory of coco fomat annotations.
         cat_file (str): The file containing the categories names.
         split_ratio (list): The split ration of train/val/test dataset.
+        workers (int, optional): Number of worker processes parsing the annotations. 
+                                 Defaults to 1.
+        materialize_mode (str, optional): How to place the images in the output directory 
+                                          (copy, hardlink, reflink or symlink). Defaults to 'copy'.
+        validate (bool, optional): Check all images in the image directory up front. 
+                                   Defaults to False.
+        incremental (bool, optional): Only convert the new or changed annotation files and 
+                                      take the others from the cache in output_dir/.cache 
+                                      (see utils.manifest.ConversionManifest). Defaults to False.
+        output_format (str, optional): 'json' for instances_<split>.json files or 'jsonl' for 
+                                       sharded JSON Lines in instances_<split>.shards (see 
+                                       utils.dataset.CocoShardWriter). Defaults to 'json'.
+        shard_size (int, optional): Number of images per shard. Defaults to 1000.
     """    
     
     dest_ann_path = os.path.join(output_dir, 'annotations')
     if not os.path.exists(dest_ann_path):
         os.makedirs(dest_ann_path)
 
-    json_info = {'train': {'file_name': os.path.join(dest_ann_path, 'instances_train.json'),
-                           'dict': {'images':[], 
-                                    'type': 'instances', 
-                                    'annotations': [], 
-                                    'categories': []}},
-                 'val': {'file_name': os.path.join(dest_ann_path, 'instances_val.json'),
-                         'dict': {'images':[], 
-                                  'type': 'instances', 
-                                  'annotations': [], 
-                                  'categories': []}},
-                 'test': {'file_name': os.path.join(dest_ann_path, 'instances_test.json'),
-                          'dict': {'images':[], 
-                                   'type': 'instances', 
-                                   'annotations': [], 
-                                   'categories': []}}}
+    cat_ids = get_category_ids(cat_file)
+    categories = [{'supercategory': 'none', 
+                   'id': cat_id, 
+                   'name': cat_name} for cat_name, cat_id in cat_ids.items()]
+    writers = {}
+    for dataset_type in ['train', 'val', 'test']:
+        fields = {'images': [], 
+                  'type': 'instances', 
+                  'annotations': [], 
+                  'categories': categories}
+        writers[dataset_type] = open_coco_writer(os.path.join(dest_ann_path, 
+                                                              'instances_{}.json'.format(dataset_type)), 
+                                                 fields, output_format, shard_size)
     
     image_id = start_id
     bnd_id = start_id
-    cat_ids = get_category_ids(cat_file)
 
-    for _, _, xml_filenames in os.walk(annotations_dir):
-        for xml_filename in xml_filenames:
-            dataset_type = get_dataset_type(split_ratio)
-            dest_img_dir = os.path.join(args.output_dir, dataset_type)
-            
-            if not os.path.exists(dest_img_dir):
-                os.makedirs(dest_img_dir)
-            
+    xml_filenames = [xml_filename for _, _, filenames in os.walk(annotations_dir) 
+                     for xml_filename in filenames]
+
+    manifest = None
+    changed_filenames = xml_filenames
+    if incremental:
+        config = {'start_id': start_id, 
+                  'images_dir': os.path.abspath(images_dir), 
+                  'annotations_dir': os.path.abspath(annotations_dir), 
+                  'categories': categories, 
+                  'split_ratio': split_ratio, 
+                  'materialize_mode': materialize_mode}
+        manifest = ConversionManifest(os.path.join(output_dir, '.cache'), config, start_id)
+        remove_files(manifest.remove_missing(xml_filenames))
+        changed_filenames = [xml_filename for xml_filename in xml_filenames 
+                             if not manifest.is_current(xml_filename)]
+        print('{0} of {1} annotation files are new or changed.'.format(len(changed_filenames), 
+                                                                       len(xml_filenames)))
+    changed_paths = [os.path.join(annotations_dir, xml_filename) for xml_filename in changed_filenames]
+
+    statuses = {}
+    if validate:
+        statuses = validate_images(images_dir, workers)
+        bad_images = {name: status for name, status in statuses.items() 
+                      if status not in ['ok', 'not_jpg']}
+        print('Validated {0} images, {1} corrupt or truncated.'.format(len(statuses), len(bad_images)))
+        for name, status in sorted(bad_images.items()):
+            print('  {0}: {1}'.format(name, status))
+
+    worker = functools.partial(read_annotation, 
+                               images_dir=images_dir, 
+                               cat_names=list(cat_ids.keys()), 
+                               check_image=not validate, 
+                               sign=incremental)
+    # Results come in the order of changed_filenames, a subsequence of xml_filenames.
+    results = parallel_imap(worker, changed_paths, workers, chunksize=64)
+    changed_filenames = set(changed_filenames)
+    for xml_filename in xml_filenames:
+        if xml_filename not in changed_filenames:
+            fragment = manifest.load_fragment(xml_filename)
+        else:
             xml_path = os.path.join(annotations_dir, xml_filename)
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-
-            src_img_path = os.path.join(images_dir, root.find('filename').text)
-            dest_img_path = os.path.join(dest_img_dir, '{}.jpg'.format(image_id))
-            shutil.copy(src_img_path, dest_img_path)
-            if not is_jpg(dest_img_path):
-                os.remove(dest_img_path)
-                continue
-
-            has_cat = False
-            for obj in get_xml_elements(root, 'object'):
-                cat_name = get_xml_elements(obj, 'name', 1).text
-                if cat_name not in cat_ids.keys():
-                    continue
-                has_cat = True
-
-                category_id = cat_ids[cat_name]
-                bndbox = get_xml_elements(obj, 'bndbox', 1)
-                xmin = int(get_xml_elements(bndbox, 'xmin', 1).text) - 1
-                ymin = int(get_xml_elements(bndbox, 'ymin', 1).text) - 1
-                xmax = int(get_xml_elements(bndbox, 'xmax', 1).text)
-                ymax = int(get_xml_elements(bndbox, 'ymax', 1).text)
-                assert(xmax > xmin)
-                assert(ymax > ymin)
-                o_width = abs(xmax - xmin)
-                o_height = abs(ymax - ymin)
-                ann = {'area': o_width*o_height, 
-                       'iscrowd': 0, 
-                       'image_id': image_id, 
-                       'bbox':[xmin, ymin, o_width, o_height],
-                       'category_id': category_id, 
-                       'id': bnd_id, 
-                       'ignore': 0,
-                       'segmentation': []}
-
-                json_info[dataset_type]['dict']['annotations'].append(ann)
-                bnd_id += 1
-
-            if has_cat:
-                size = get_xml_elements(root, 'size', 1)
-                width = int(get_xml_elements(size, 'width', 1).text)
-                height = int(get_xml_elements(size, 'height', 1).text)
-                image = {'file_name': '{}.jpg'.format(image_id), 
-                         'height': height, 
-                         'width': width,
-                         'id':image_id}
-
-                json_info[dataset_type]['dict']['images'].append(image)
+            voc = next(results)
+            dataset_type = get_dataset_type(split_ratio, xml_filename)
+            fragment = None
+            outputs = []
+            src_img_path = os.path.join(images_dir, voc['filename']) if voc['objects'] else None
+            status = None
+            if src_img_path is not None:
+                status = voc['image_status'] or statuses.get(voc['filename']) or check_jpg(src_img_path)
+                if status not in ['ok', 'not_jpg']:
+                    print('Skipped {0} image: {1}'.format(status, src_img_path))
+
+            if status == 'ok':
+                if manifest is not None:
+                    image_id = manifest.assign_id(xml_filename)
+                dest_img_dir = os.path.join(output_dir, dataset_type)
+                if not os.path.exists(dest_img_dir):
+                    os.makedirs(dest_img_dir)
+
+                dest_img_path = os.path.join(dest_img_dir, '{}.jpg'.format(image_id))
+                materialize(src_img_path, dest_img_path, materialize_mode)
+                image, annotations = build_records(voc, xml_path, image_id, cat_ids)
+                fragment = {'dataset_type': dataset_type, 'image': image, 'annotations': annotations}
+                outputs.append(dest_img_path)
                 image_id += 1
                 print('Processed id: {0}, file name: {1}'.format(image_id, dest_img_path))
 
-    for cat_name, cat_id in cat_ids.items():
-        cat = {'supercategory': 'none', 
-               'id': cat_id, 
-               'name': cat_name}
-        for dataset_type in json_info.keys():
-            json_info[dataset_type]['dict']['categories'].append(cat)
+            if manifest is not None:
+                item_id = fragment['image']['id'] if fragment is not None else None
+                remove_files(manifest.update(xml_filename, voc['signature'], fragment, item_id, outputs))
 
-    for dataset_type in json_info.keys():
-        for cat_name, cat_id in cat_ids.items():
-            cat = {'supercategory': 'none', 
-                'id': cat_id, 
-                'name': cat_name}
-            json_info[dataset_type]['dict']['categories'].append(cat)    
+        if fragment is None:
+            continue
+        for ann in fragment['annotations']:
+            ann['id'] = bnd_id
+            bnd_id += 1
+        writers[fragment['dataset_type']].add_record(fragment['image'], fragment['annotations'])
 
-        with open(json_info[dataset_type]['file_name'], 'w') as json_fp:
-            json_str = json.dumps(json_info[dataset_type]['dict'])
-            json_fp.write(json_str)
+    for writer in writers.values():
+        writer.close()
+    if manifest is not None:
+        manifest.save()
 
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
     convert_annotations(args.start_id, args.images_dir, args.annotations_dir, 
-                        args.output_dir, args.cat_file, args.split_ratio)
\ No newline at end of file
+                        args.output_dir, args.cat_file, args.split_ratio, args.workers, 
+                        args.materialize, args.validate_images, args.incremental, 
+                        args.output_format, args.shard_size)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
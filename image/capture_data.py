@@ -1,8 +1,17 @@
 import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
 import argparse
-import cv2
 
-def get_args():
+from utils import profiler
+from utils.image import AsyncImageWriter
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Capture data (images/video) via camera.')
     parser.add_argument('--cam-id', type=int, default=0, 
                         help='Camera index.')
@@ -14,11 +23,26 @@ def get_args():
                         help='Image/video width.')
     parser.add_argument('--height', type=int, 
                         help='Image/video height.')
+    parser.add_argument('--format', type=str, default='png', 
+                        help='Format of captured images.')
+    parser.add_argument('--quality', type=int, 
+                        help='JPEG/WebP quality (0-100) or PNG compression level (0-9).')
+    parser.add_argument('--writer-threads', type=int, default=2, 
+                        help='Number of image encoder threads.')
+    parser.add_argument('--queue-size', type=int, default=64, 
+                        help='Maximum number of frames waiting to be encoded.')
+    parser.add_argument('--no-drop', action='store_true', 
+                        help='Wait for the encoders when the queue is full instead of dropping the frame '
+                             '(stalls the capture).')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
     
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
 
     cap = cv2.VideoCapture(args.cam_id)
     w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) if args.width == None else args.width
@@ -31,6 +55,10 @@ if __name__ == '__main__':
         print('Start capturing images...')
         if not os.path.exists(args.save_path):
             os.makedirs(args.save_path)
+        # Frames are dropped (and counted) rather than stalling the camera when the encoders 
+        # fall behind, unless --no-drop.
+        writer = AsyncImageWriter(args.writer_threads, args.queue_size, args.format, args.quality, 
+                                  block=args.no_drop)
     elif args.mode == 2:
         print('Start capturing video...')
         fourcc = cv2.VideoWriter_fourcc(*'mp4v') 
@@ -42,9 +70,12 @@ if __name__ == '__main__':
         ret, frame = cap.read()
         cv2.imshow('Capture', frame)
         if args.mode == 1:
-            file_name = os.path.join(args.save_path, '{}.png'.format(idx))
-            cv2.imwrite(file_name, frame) 
-            print('Saved image to ', file_name)
+            file_name = writer.write(os.path.join(args.save_path, '{0}.{1}'.format(idx, args.format)), 
+                                     frame)
+            if file_name is None:
+                print('Dropped frame {} (the writer queue is full)'.format(idx))
+            else:
+                print('Saved image to ', file_name)
             idx += 1 
         elif args.mode == 2:
             out.write(frame)
@@ -53,5 +84,13 @@ if __name__ == '__main__':
             break
 
     cap.release()
+    if args.mode == 1:
+        writer.close()
+        print(writer.summary())
     if args.mode == 2:
-        out.release()
\ No newline at end of file
+        out.release()
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
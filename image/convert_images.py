@@ -0,0 +1,52 @@
+import os
+import sys
+parent_path = os.path.dirname(sys.path[0])
+if parent_path not in sys.path:
+    sys.path.append(parent_path)
+import argparse
+
+from utils import profiler
+from utils.image import convert_img
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert and resize images.')
+    parser.add_argument('--img-source', type=str, 
+                        help='Directory of images or name of an image.')
+    parser.add_argument('--save-dir', type=str, 
+                        help='Save directory of output images.')
+    parser.add_argument('--width', type=int, 
+                        help='Maximum width of output images (keeps the original size by default).')
+    parser.add_argument('--height', type=int, 
+                        help='Maximum height of output images (keeps the original size by default).')
+    parser.add_argument('--format', type=str, default='png', 
+                        help='Format of output images.')
+    parser.add_argument('--quality', type=int, 
+                        help='JPEG/WebP quality (0-100).')
+    parser.add_argument('--workers', type=int, default=1, 
+                        help='Number of worker processes.')
+    parser.add_argument('--list-cache', type=str, 
+                        help='Directory where the listing of --img-source is cached, reused while the '
+                             'directory is unchanged.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
+    if not os.path.exists(args.save_dir):
+        os.makedirs(args.save_dir)
+    img_size = None
+    if args.width is not None or args.height is not None:
+        # A missing dimension does not limit the size.
+        img_size = (args.width or 1 << 30, args.height or 1 << 30)
+
+    convert_img(args.img_source, args.save_dir, img_size, args.format, args.quality, args.workers, 
+                args.list_cache)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,13 @@ import sys
 parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
-import shutil
 import argparse
 
-from utils.image import create_gif, convert_img
+from utils import profiler
+from utils.general import FILE_ORDERS
+from utils.image import create_gif
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Images to gif.')
     parser.add_argument('--img-dir', type=str, 
                         help='Directory of images.')
@@ -20,10 +21,25 @@ def get_args():
                         help='Images height.')
     parser.add_argument('--duration', type=float, default=0.1, 
                         help='Frame duration.')
+    parser.add_argument('--frame-skip', type=int, default=1, 
+                        help='Keeps one image in the specified number.')
+    parser.add_argument('--max-frames', type=int, 
+                        help='The maximum number of frames.')
+    parser.add_argument('--palette-samples', type=int, default=16, 
+                        help='Number of frames sampled to compute the global palette.')
 
-    return parser.parse_args()
+    parser.add_argument('--order', type=str, default='mtime', choices=FILE_ORDERS, 
+                        help='Order of the images (natural compares numbers in names numerically).')
+    parser.add_argument('--list-cache', type=str, 
+                        help='Directory where the listing of --img-dir is cached, reused while the '
+                             'directory is unchanged.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-def process_images(img_dir, save_path, img_size, duration):
+    return parser.parse_args(argv)
+
+def process_images(img_dir, save_path, img_size, duration, frame_skip=1, max_frames=None, 
+                   palette_samples=16, order='mtime', cache_dir=None):
     """Convert images to a gif file.
 
     Args:
@@ -31,23 +47,33 @@ def process_images(img_dir, save_path, img_size, duration):
         save_path (str): The sace path of created gif file.
         img_size (tuple): The size of converted images.
         duration (float): The frame duration of the gif file.
+        frame_skip (int, optional): Keeps one image in frame_skip. Defaults to 1.
+        max_frames (int, optional): The maximum number of frames. Defaults to None.
+        palette_samples (int, optional): Number of frames sampled to compute the global palette. 
+                                         Defaults to 16.
+        order (str, optional): The order of the images. Defaults to 'mtime'.
+        cache_dir (str, optional): Directory of the listing cache. Defaults to None.
     """    
 
-    temp_dir = os.path.join(os.path.split(save_path)[0], 'temp')
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
     save_dir = os.path.split(save_path)[0]
-    if not os.path.exists(save_dir):
+    if save_dir and not os.path.exists(save_dir):
         os.makedirs(save_dir)
-    print('Start conveting images...')
-    convert_img(img_dir, temp_dir, img_size)
     print('Start creating gif file...')
-    create_gif(save_path, temp_dir, duration=duration)
-    shutil.rmtree(temp_dir)
+    create_gif(save_path, img_dir, duration=duration, img_size=img_size, frame_skip=frame_skip, 
+               max_frames=max_frames, palette_samples=palette_samples, order=order, 
+               cache_dir=cache_dir)
 
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
     save_path = os.path.join(args.img_dir, '{}.gif'.format(os.path.basename(args.img_dir))) \
                 if not args.save_path else args.save_path
 
-    process_images(args.img_dir, save_path, (args.width, args.height), args.duration)
\ No newline at end of file
+    process_images(args.img_dir, save_path, (args.width, args.height), args.duration, 
+                   args.frame_skip, args.max_frames, args.palette_samples, args.order, args.list_cache)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
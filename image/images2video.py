@@ -3,12 +3,13 @@ import sys
 parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
-import shutil
 import argparse
 
-from utils.image import create_video, convert_img
+from utils import profiler
+from utils.general import FILE_ORDERS
+from utils.image import create_video
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Images to gif.')
     parser.add_argument('--img-dir', type=str, 
                         help='Directory of images.')
@@ -21,9 +22,17 @@ def get_args():
     parser.add_argument('--fps', type=int, default=30, 
                         help='Frame rate.')
 
-    return parser.parse_args()
+    parser.add_argument('--order', type=str, default='mtime', choices=FILE_ORDERS, 
+                        help='Order of the images (natural compares numbers in names numerically).')
+    parser.add_argument('--list-cache', type=str, 
+                        help='Directory where the listing of --img-dir is cached, reused while the '
+                             'directory is unchanged.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-def process_images(img_dir, save_path, fps, img_size):
+    return parser.parse_args(argv)
+
+def process_images(img_dir, save_path, fps, img_size, order='mtime', cache_dir=None):
     """Convert images to a video file.
 
     Args:
@@ -31,23 +40,27 @@ def process_images(img_dir, save_path, fps, img_size):
         save_path (str): The sace path of created gif file.
         fps (float): The frame rate of the video file.
         img_size (tuple): The size of converted images.
+        order (str, optional): The order of the images. Defaults to 'mtime'.
+        cache_dir (str, optional): Directory of the listing cache. Defaults to None.
     """    
 
-    temp_dir = os.path.join(os.path.split(save_path)[0], 'temp')
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
     save_dir = os.path.split(save_path)[0]
-    if not os.path.exists(save_dir):
+    if save_dir and not os.path.exists(save_dir):
         os.makedirs(save_dir)
-    print('Start conveting images...')
-    convert_img(img_dir, temp_dir, img_size)
     print('Start creating video file...')
-    create_video(save_path, temp_dir, fps, img_size)
-    shutil.rmtree(temp_dir)
+    create_video(save_path, img_dir, fps, img_size, order, cache_dir)
 
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
     save_path = os.path.join(args.img_dir, '{}.mp4'.format(os.path.basename(args.img_dir))) \
                 if not args.save_path else args.save_path
 
-    process_images(args.img_dir, save_path, args.fps, (args.width, args.height))
\ No newline at end of file
+    process_images(args.img_dir, save_path, args.fps, (args.width, args.height), args.order, 
+                   args.list_cache)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
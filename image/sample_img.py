@@ -6,10 +6,14 @@ if parent_path not in sys.path:
 import argparse
 import glob
 import random
-from tqdm import tqdm
-import shutil
 
-def get_args():
+from utils import profiler
+from utils.general import materialize, MATERIALIZE_MODES
+from utils.lazy import lazy_import
+
+tqdm = lazy_import('tqdm')
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Randomly select images.')
     parser.add_argument('--img-dir', type=str, 
                         help='Directory of images.')
@@ -23,12 +27,18 @@ def get_args():
                         help='The start index of renamed files.')
     parser.add_argument('--target-type', type=str, default='jpg', 
                         help='Only sample files that have the target type.')
+    parser.add_argument('--materialize', type=str, default='copy', choices=MATERIALIZE_MODES, 
+                        help='How to place the samples in the save directory.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-if __name__ == '__main__':
-    args = get_args()
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
     img_dir, save_dir, n_samples, prefix, start_idx, target_type = \
         args.img_dir, args.save_dir, args.n_samples, args.prefix, args.start_idx, args.target_type
     
@@ -38,8 +48,13 @@ if __name__ == '__main__':
     src_img_paths = glob.glob('{0}/**/*.{1}'.format(img_dir, target_type))
     sel_samples = random.sample(src_img_paths, n_samples)
     
-    pbar = tqdm(sel_samples)
+    pbar = tqdm.tqdm(sel_samples)
     for i, src_path in enumerate(pbar):
         dest_path = os.path.join(save_dir, '{0}_{1}.{2}'.format(prefix, start_idx+i, target_type))
-        shutil.copy(src_path, dest_path)
+        materialize(src_path, dest_path, args.materialize)
         pbar.set_description('Copyed to: {}'.format(dest_path))
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
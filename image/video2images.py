@@ -3,12 +3,14 @@ import sys
 parent_path = os.path.dirname(sys.path[0])
 if parent_path not in sys.path:
     sys.path.append(parent_path)
-import cv2
 import argparse
+import functools
 
-from utils.general import VideoReader
+from utils import profiler
+from utils.general import SampledVideoReader, parallel_imap
+from utils.image import AsyncImageWriter
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description='Video to images.')
     parser.add_argument('--video-source', type=str, 
                         help='Directory of videos/name of a video.')
@@ -16,39 +18,93 @@ def get_args():
                         help='Save directory of output images.')
     parser.add_argument('--interval', type=int, default=1, 
                         help='Extracts images at the specified interval')
+    parser.add_argument('--fps', type=float, 
+                        help='Extracts images at the specified frame rate (overrides --interval).')
+    parser.add_argument('--timestamps', type=float, nargs='+', 
+                        help='Extracts images at the specified timestamps in seconds '
+                             '(overrides --interval and --fps).')
+    parser.add_argument('--seek-threshold', type=int, default=300, 
+                        help='Seeks instead of skipping frames one by one when the gap is larger '
+                             'than this number of frames.')
+    parser.add_argument('--workers', type=int, default=1, 
+                        help='Number of videos processed in parallel when --video-source is a directory.')
+    parser.add_argument('--format', type=str, default='jpg', 
+                        help='Format of output images.')
+    parser.add_argument('--quality', type=int, 
+                        help='JPEG/WebP quality (0-100) or PNG compression level (0-9).')
+    parser.add_argument('--writer-threads', type=int, default=2, 
+                        help='Number of image encoder threads per video.')
+    parser.add_argument('--queue-size', type=int, default=64, 
+                        help='Maximum number of frames waiting to be encoded.')
+    parser.add_argument('--profile', type=str, nargs='?', const='profile.json', 
+                        help='Print the time spent in each stage and save it to this JSON file.')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
-def process_video(file_name, save_path, interval=1):
+def process_video(file_name, save_path, interval=1, fps=None, timestamps=None, seek_threshold=300, 
+                  img_format='jpg', quality=None, writer_threads=2, queue_size=64):
     """Convert a video file into a series of images.
 
     Args:
         file_name (str): The file name of video to convert.
-        save_path (_type_): The path to save the converted images.
+        save_path (str): The path to save the converted images.
         interval (int, optional): Extracts images at the specified interval. Defaults to 1.
+        fps (float, optional): Extracts images at the specified frame rate. Defaults to None.
+        timestamps (list, optional): Extracts images at the specified timestamps in seconds. 
+                                     Defaults to None.
+        seek_threshold (int, optional): Seeks instead of skipping frames one by one when the 
+                                        gap is larger than this number of frames. Defaults to 300.
+        img_format (str, optional): Format of output images. Defaults to 'jpg'.
+        quality (int, optional): JPEG/WebP quality or PNG compression level. Defaults to None.
+        writer_threads (int, optional): Number of image encoder threads. Defaults to 2.
+        queue_size (int, optional): Maximum number of frames waiting to be encoded. Defaults to 64.
+
+    Returns:
+        int: The number of saved images.
     """    
 
     if not os.path.exists(save_path):
         os.makedirs(save_path)
 
     img_id = 1
-    frame_provider = VideoReader(file_name)
-    for i, (_, frame) in enumerate(frame_provider):
-        if i == (img_id - 1) * interval:
-            output_name = os.path.splitext(os.path.split(file_name)[1])[0] + '_{}.jpg'.format(img_id)
-            output_path = os.path.join(save_path, output_name)
-            cv2.imwrite(output_path, frame)
+    frame_provider = SampledVideoReader(file_name, interval, fps, timestamps, seek_threshold)
+    with AsyncImageWriter(writer_threads, queue_size, img_format, quality) as writer:
+        for _, frame in frame_provider:
+            output_name = '{0}_{1}.{2}'.format(os.path.splitext(os.path.split(file_name)[1])[0], 
+                                               img_id, img_format)
+            output_path = writer.write(os.path.join(save_path, output_name), frame)
             img_id += 1
             print('Saved frame {}'.format(output_path))
+    print(writer.summary())
 
-if __name__ == '__main__':
-    args = get_args()
+    return img_id - 1
+
+def process_video_task(task, **kwargs):
+    return process_video(*task, **kwargs)
+
+def main(argv=None):
+    args = get_args(argv)
+    if args.profile:
+        profiler.enable()
+    options = dict(interval=args.interval, 
+                   fps=args.fps, 
+                   timestamps=args.timestamps, 
+                   seek_threshold=args.seek_threshold, 
+                   img_format=args.format, 
+                   quality=args.quality, 
+                   writer_threads=args.writer_threads, 
+                   queue_size=args.queue_size)
     if os.path.isdir(args.video_source):
-        for video_name in os.listdir(args.video_source):
-            video_path = os.path.join(args.video_source, video_name)
-            process_video(video_path, 
-                          os.path.join(args.save_dir, 
-                                       os.path.splitext(video_name)[0]), 
-                                       args.interval)
+        tasks = [(os.path.join(args.video_source, video_name), 
+                  os.path.join(args.save_dir, os.path.splitext(video_name)[0])) 
+                 for video_name in sorted(os.listdir(args.video_source))]
+        worker = functools.partial(process_video_task, **options)
+        for (video_path, _), n_images in zip(tasks, parallel_imap(worker, tasks, args.workers)):
+            print('Extracted {0} images from {1}'.format(n_images, video_path))
     elif os.path.isfile(args.video_source):
-        process_video(args.video_source, args.save_dir, args.interval)
\ No newline at end of file
+        process_video(args.video_source, args.save_dir, **options)
+    if args.profile:
+        profiler.report(args.profile)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import importlib
+import sys
+
+# Command name -> (module, description). The module of a command is only imported
+# once it is chosen, and the modules import their heavy dependencies lazily.
+COMMANDS = {
+    'voc2coco': ('dataset.voc2coco', 'Convert dataset from VOC format to COCO format.'),
+    'labelme2coco': ('dataset.labelme2coco', 'Convert labelme annotations to COCO format.'),
+    'coco2labelme': ('dataset.coco2labelme', 'Convert COCO annotations to labelme format.'),
+    'coco_extract_cats': ('dataset.coco_extract_cats', 'Extract specified categories from COCO.'),
+    'visualize': ('dataset.visualize', 'Render previews of converted COCO or VOC annotations.'),
+    'merge_shards': ('dataset.merge_shards', 'Concatenate sharded COCO JSON Lines into a COCO file.'),
+    'batch_rename': ('dataset.batch_rename', 'Batch rename files.'),
+    'capture_data': ('image.capture_data', 'Capture data (images/video) via camera.'),
+    'video2images': ('image.video2images', 'Video to images.'),
+    'images2gif': ('image.images2gif', 'Images to gif.'),
+    'images2video': ('image.images2video', 'Images to video.'),
+    'sample_img': ('image.sample_img', 'Randomly select images.'),
+    'convert_images': ('image.convert_images', 'Convert and resize images.'),
+}
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Datasets-processor tools, run "main.py <command> -h" '
+                                                 'for the options of a command.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for name, (_, description) in COMMANDS.items():
+        subparsers.add_parser(name, help=description)
+
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        # Prints the usage, or the error for an unknown command.
+        get_parser().parse_args(argv[:1] or ['-h'])
+        return
+
+    command, command_argv = argv[0], argv[1:]
+    # The usage of the command then reads "main.py <command> ...".
+    sys.argv[0] = '{0} {1}'.format(sys.argv[0], command)
+    importlib.import_module(COMMANDS[command][0]).main(command_argv)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import array
+import json
+import os
+
+from utils import profiler
+from utils.dataset import iter_json_items
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+CACHE_VERSION = 2
+
+# The arrays of an index, all stored as .npy files in the cache directory.
+ARRAY_NAMES = ['img_ids', 'img_heights', 'img_widths', 'img_names', 'img_name_offsets', 'img_order',
+               'img_sorted_ids', 'img_ann_offsets', 'ann_ids', 'ann_image_ids', 'ann_cat_ids',
+               'ann_bboxes', 'ann_areas', 'ann_iscrowd', 'ann_order', 'ann_sorted_ids']
+
+def _gather_ranges(starts, ends):
+    """Concatenate the ranges [starts[i], ends[i]) without a Python loop."""
+
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(total)
+
+def _lookup(ids, sorted_order, sorted_values):
+    """Get the positions of ids in values, given its argsort and values[sorted_order].
+
+    Only the searched ids are touched, so a lookup costs O(len(ids) log(len(values))).
+
+    Returns:
+        numpy.ndarray: The positions, -1 for a missing id.
+    """
+
+    ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+    if len(sorted_values) == 0:
+        return np.full(len(ids), -1, np.int64)
+    pos = np.minimum(np.searchsorted(sorted_values, ids), len(sorted_values) - 1)
+    return np.where(sorted_values[pos] == ids, sorted_order[pos], -1)
+
+class CocoIndex(object):
+    """A compact, read-only index of the images, categories and boxes of a coco file.
+
+    The annotations are stored as typed arrays (struct of arrays) sorted by image,
+    so that the annotations of the i-th image are ann_*[img_ann_offsets[i]:img_ann_offsets[i + 1]]
+    (CSR offsets); segmentations are not kept, and annotations of unknown images are
+    dropped. Images and annotations keep their file order, and their ids are also kept
+    sorted (*_order, *_sorted_ids) for binary searches. The queries mirror those of
+    pycocotools.coco.COCO, vectorized over the arrays: query many ids in one call rather
+    than one call per id.
+
+    Use CocoIndex.load, which builds the index once and memory-maps it from the cache
+    afterwards.
+
+    Args:
+        arrays (dict): The arrays of ARRAY_NAMES.
+        categories (list): The [id, name] of each category in file order.
+    """
+
+    def __init__(self, arrays, categories):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.cat_ids = np.asarray([cat_id for cat_id, _ in categories], dtype=np.int64)
+        self.cat_names = [name for _, name in categories]
+
+    @classmethod
+    def load(cls, json_path, cache_dir=None):
+        """Load the index of a coco file, from the cache if it is up to date.
+
+        The cache is keyed by the path, mtime and size of the coco file. If it cannot be
+        written (e.g. a read-only dataset directory), the index is only kept in memory.
+
+        Args:
+            json_path (str): The coco annotation file.
+            cache_dir (str, optional): The cache directory. Defaults to None
+                                       (<json dir>/.cache/<json name>.index).
+
+        Returns:
+            CocoIndex: The index.
+        """
+
+        if cache_dir is None:
+            base = os.path.splitext(os.path.basename(json_path))[0]
+            cache_dir = os.path.join(os.path.dirname(json_path), '.cache', base + '.index')
+        st = os.stat(json_path)
+        key = {'version': CACHE_VERSION,
+               'path': os.path.abspath(json_path),
+               'mtime_ns': st.st_mtime_ns,
+               'size': st.st_size}
+
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if meta is not None and meta['key'] == key:
+            with profiler.stage('load_index'):
+                arrays = {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+                          for name in ARRAY_NAMES}
+                return cls(arrays, meta['categories'])
+
+        with profiler.stage('build_index') as stage:
+            if stage:
+                stage.add_bytes(st.st_size)
+            arrays, categories = cls.build(json_path)
+        try:
+            cls.save(cache_dir, arrays, {'key': key, 'categories': categories})
+        except OSError as e:
+            print('The coco index cannot be cached in {0}: {1}'.format(cache_dir, e))
+        return cls(arrays, categories)
+
+    @staticmethod
+    def build(json_path):
+        """Build the arrays of the index by streaming a coco file.
+
+        Args:
+            json_path (str): The coco annotation file.
+
+        Returns:
+            tuple: The arrays and the categories (see CocoIndex).
+        """
+
+        img_ids, img_heights, img_widths = array.array('q'), array.array('q'), array.array('q')
+        img_names = bytearray()
+        img_name_offsets = array.array('q', [0])
+        categories = []
+        ann_ids, ann_image_ids, ann_cat_ids = array.array('q'), array.array('q'), array.array('q')
+        ann_bboxes, ann_areas, ann_iscrowd = array.array('d'), array.array('d'), array.array('b')
+        for key, item in iter_json_items(json_path):
+            if key == 'images':
+                img_ids.append(item['id'])
+                img_heights.append(item['height'])
+                img_widths.append(item['width'])
+                img_names += item['file_name'].encode('utf-8')
+                img_name_offsets.append(len(img_names))
+            elif key == 'categories':
+                categories.append([item['id'], item['name']])
+            elif key == 'annotations':
+                ann_ids.append(item['id'])
+                ann_image_ids.append(item['image_id'])
+                ann_cat_ids.append(item['category_id'])
+                # Annotations without a box get NaN coordinates.
+                bbox = item.get('bbox')
+                ann_bboxes.extend(bbox if bbox and len(bbox) == 4 else [float('nan')] * 4)
+                ann_areas.append(item.get('area', 0))
+                ann_iscrowd.append(item.get('iscrowd', 0))
+
+        img_ids = np.asarray(img_ids, dtype=np.int64)
+        img_order = np.argsort(img_ids, kind='stable')
+        ann_image_ids = np.asarray(ann_image_ids, dtype=np.int64)
+        # Sort the annotations by the position of their image (stable, so in file order).
+        img_sorted_ids = img_ids[img_order]
+        img_pos = _lookup(ann_image_ids, img_order, img_sorted_ids)
+        known = np.flatnonzero(img_pos >= 0)
+        order = known[np.argsort(img_pos[known], kind='stable')]
+        counts = np.bincount(img_pos[known], minlength=len(img_ids))
+        ann_ids = np.asarray(ann_ids, dtype=np.int64)[order]
+        ann_order = np.argsort(ann_ids, kind='stable')
+
+        arrays = {
+            'img_ids': img_ids,
+            'img_heights': np.asarray(img_heights, dtype=np.int64),
+            'img_widths': np.asarray(img_widths, dtype=np.int64),
+            'img_names': np.frombuffer(bytes(img_names), dtype=np.uint8),
+            'img_name_offsets': np.asarray(img_name_offsets, dtype=np.int64),
+            'img_order': img_order,
+            'img_sorted_ids': img_sorted_ids,
+            'img_ann_offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'ann_ids': ann_ids,
+            'ann_image_ids': ann_image_ids[order],
+            'ann_cat_ids': np.asarray(ann_cat_ids, dtype=np.int64)[order],
+            'ann_bboxes': np.asarray(ann_bboxes, dtype=np.float64).reshape(-1, 4)[order],
+            'ann_areas': np.asarray(ann_areas, dtype=np.float64)[order],
+            'ann_iscrowd': np.asarray(ann_iscrowd, dtype=np.int8)[order],
+            'ann_order': ann_order,
+            'ann_sorted_ids': ann_ids[ann_order],
+        }
+        return arrays, categories
+
+    @staticmethod
+    def save(cache_dir, arrays, meta):
+        """Write the arrays and the meta data of an index, the meta data last."""
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(cache_dir, name + '.npy'), arrays[name])
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    def get_cat_ids(self, cat_names=None):
+        """Get the ids of the categories (in file order), optionally only those with the given names.
+
+        Args:
+            cat_names (list, optional): The category names. Defaults to None (all).
+
+        Returns:
+            numpy.ndarray: The category ids.
+        """
+
+        if cat_names is None:
+            return self.cat_ids.copy()
+        names = set(cat_names)
+        return self.cat_ids[[name in names for name in self.cat_names]]
+
+    def get_img_ids(self, cat_ids=None):
+        """Get the ids of the images (in file order) that contain all the given categories.
+
+        Args:
+            cat_ids (list, optional): The category ids. Defaults to None (all images).
+
+        Returns:
+            numpy.ndarray: The image ids.
+        """
+
+        keep = np.ones(len(self.img_ids), dtype=bool)
+        if cat_ids is not None:
+            # The position of the image of each annotation, from the CSR offsets.
+            ann_img_pos = np.repeat(np.arange(len(self.img_ids)), np.diff(self.img_ann_offsets))
+            for cat_id in np.asarray(cat_ids, dtype=np.int64).reshape(-1):
+                has_cat = np.zeros(len(self.img_ids), dtype=bool)
+                has_cat[ann_img_pos[self.ann_cat_ids == cat_id]] = True
+                keep &= has_cat
+        return np.asarray(self.img_ids[keep])
+
+    def get_ann_ids(self, img_ids=None, cat_ids=None, iscrowd=None):
+        """Get the ids of the annotations of the given images and categories.
+
+        Args:
+            img_ids (list, optional): The image ids. Defaults to None (all images).
+            cat_ids (list, optional): The category ids. Defaults to None (all categories).
+            iscrowd (bool, optional): Only crowd (True) or non-crowd (False) annotations.
+                                      Defaults to None (both).
+
+        Returns:
+            numpy.ndarray: The annotation ids, grouped by image in the order of img_ids.
+        """
+
+        if img_ids is None:
+            idx = np.arange(len(self.ann_ids))
+        else:
+            pos = _lookup(img_ids, self.img_order, self.img_sorted_ids)
+            pos = pos[pos >= 0]
+            idx = _gather_ranges(self.img_ann_offsets[pos], self.img_ann_offsets[pos + 1])
+        if cat_ids is not None:
+            idx = idx[np.isin(self.ann_cat_ids[idx], np.asarray(cat_ids, dtype=np.int64))]
+        if iscrowd is not None:
+            idx = idx[(self.ann_iscrowd[idx] != 0) == bool(iscrowd)]
+        return np.asarray(self.ann_ids[idx])
+
+    def load_imgs(self, ids):
+        """Get the images with the given ids.
+
+        Args:
+            ids (list): The image ids (unknown ids are skipped).
+
+        Returns:
+            list: The 'id', 'file_name', 'height' and 'width' of each image.
+        """
+
+        pos = _lookup(ids, self.img_order, self.img_sorted_ids)
+        imgs = []
+        for i in pos[pos >= 0].tolist():
+            start, end = self.img_name_offsets[i], self.img_name_offsets[i + 1]
+            imgs.append({'id': int(self.img_ids[i]),
+                         'file_name': bytes(self.img_names[start:end]).decode('utf-8'),
+                         'height': int(self.img_heights[i]),
+                         'width': int(self.img_widths[i])})
+        return imgs
+
+    def load_anns(self, ids):
+        """Get the annotations with the given ids.
+
+        Args:
+            ids (list): The annotation ids (unknown ids are skipped).
+
+        Returns:
+            list: The 'id', 'image_id', 'category_id', 'bbox' (None if missing), 'area' and
+                  'iscrowd' of each annotation.
+        """
+
+        pos = _lookup(ids, self.ann_order, self.ann_sorted_ids)
+        pos = pos[pos >= 0]
+        bboxes = np.asarray(self.ann_bboxes[pos])
+        missing = np.isnan(bboxes).any(axis=1).tolist()
+        anns = []
+        for ann_id, image_id, cat_id, bbox, no_bbox, area, iscrowd in zip(
+                self.ann_ids[pos].tolist(), self.ann_image_ids[pos].tolist(),
+                self.ann_cat_ids[pos].tolist(), bboxes.tolist(), missing,
+                self.ann_areas[pos].tolist(), self.ann_iscrowd[pos].tolist()):
+            anns.append({'id': ann_id,
+                         'image_id': image_id,
+                         'category_id': cat_id,
+                         'bbox': None if no_bbox else bbox,
+                         'area': area,
+                         'iscrowd': iscrowd})
+        return anns
@@ -1,19 +1,37 @@
-import numpy as np
-from skimage.measure import find_contours
-from utils.general import random_index
+import collections
+import hashlib
+import json
+import os
+import shutil
+import xml.etree.ElementTree as ET
 
-def get_dataset_type(split_ratio):
-    """Randomly get the dataset type according to the specified probability.
+from utils import profiler
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+measure = lazy_import('skimage.measure')
+
+def get_dataset_type(split_ratio, key):
+    """Get the dataset type of a file according to the specified ratio.
+
+    The type is drawn from a hash of the key instead of a random number, so a file 
+    stays in the same split across runs and when other files are added or removed.
 
     Args:
         split_ratio (list): The split ration of train/val/test dataset.
+        key (str): A stable key of the file, e.g. its file name.
 
     Returns:
         str: The selected dataset type.
     """    
 
     dataset_types = ['train', 'val', 'test']
-    return dataset_types[random_index(split_ratio)]
+    digest = hashlib.md5(key.encode('utf-8')).digest()
+    value = int.from_bytes(digest[:8], 'big') % sum(split_ratio)
+    for dataset_type, scope in zip(dataset_types, split_ratio):
+        if value < scope:
+            return dataset_type
+        value -= scope
 
 def get_category_ids(cat_file, no_background=True):
     """Get categories names and ids from a given file.
@@ -46,35 +64,654 @@ def coco2shape(row):
     return shapes
 
 def rle2shape(row):
-    rle, shape = row['segmentation']['counts'], row['segmentation']['size']
+    rle, shape = row.segmentation['counts'], row.segmentation['size']
     mask = rle_decode(rle, shape)
     padded_mask = np.zeros((mask.shape[0]+2, mask.shape[1]+2),
                             dtype=np.uint8,)
     padded_mask[1:-1, 1:-1] = mask
-    points = find_contours(mask, 0.5)
+    points = measure.find_contours(mask, 0.5)
     shapes = [[[int(point[1]), int(point[0])] for point in polygon]
               for polygon in points]
     return shapes
 
+def rle_string_to_counts(rle):
+    """Decode the compressed string form of COCO RLE counts.
+
+    Args:
+        rle (str or bytes): The compressed counts as produced by pycocotools.
+
+    Returns:
+        list: The uncompressed run lengths.
+    """
+
+    if isinstance(rle, bytes):
+        rle = rle.decode('ascii')
+
+    counts = []
+    p = 0
+    while p < len(rle):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(rle[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+
+    return counts
+
 def rle_decode(rle, shape):
-    mask = np.zeros([shape[0] * shape[1]], np.bool)
-    for idx, r in enumerate(rle):
-        s = 0 if idx < 1 else sum(rle[:idx])
-        e = s + r
-        if e == s:
-            continue
-        assert 0 <= s < mask.shape[0]
-        assert 1 <= e <= mask.shape[0], 'shape: {}  s {}  e {} r {}'.format(shape, s, e, r)
-        if idx % 2 == 1:
-            mask[s:e] = 1
+    """Decode COCO RLE counts into a binary mask.
+
+    Args:
+        rle (list or str or bytes): The run lengths, either uncompressed or in 
+                                    the compressed string form.
+        shape (list): The mask size as [height, width].
+
+    Returns:
+        numpy.ndarray: The decoded boolean mask of the given shape.
+    """
+
+    if isinstance(rle, (str, bytes)):
+        rle = rle_string_to_counts(rle)
+    counts = np.asarray(rle, dtype=np.int64)
+    n_pixels = shape[0] * shape[1]
+    assert (counts >= 0).all(), 'shape: {}  negative run length'.format(shape)
+    n_filled = int(counts.sum())
+    assert n_filled <= n_pixels, 'shape: {}  total {}'.format(shape, n_filled)
+
+    # Runs alternate between background and foreground, starting with background.
+    mask = np.zeros([n_pixels], bool)
+    values = np.arange(len(counts)) % 2 == 1
+    mask[:n_filled] = np.repeat(values, counts)
 
     # Reshape and transpose
     mask = mask.reshape([shape[1], shape[0]]).T
     return mask
 
+def runs_to_rle(starts, ends, shape):
+    """Encode the foreground runs of a mask as uncompressed COCO RLE.
+
+    Args:
+        starts (numpy.ndarray): The sorted start indices of the runs in column-major order.
+        ends (numpy.ndarray): The (exclusive) end indices of the runs.
+        shape (list): The mask size as [height, width].
+
+    Returns:
+        dict: The RLE with 'size' and (uncompressed) 'counts'.
+    """
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    # Runs that touch (e.g. across full-height columns) are a single run.
+    new_run = np.ones(len(starts), bool)
+    new_run[1:] = starts[1:] != ends[:-1]
+    last_of_run = np.ones(len(ends), bool)
+    last_of_run[:-1] = new_run[1:]
+    bounds = np.stack([starts[new_run], ends[last_of_run]], axis=1).ravel()
+    counts = np.diff(np.concatenate([[0], bounds, [shape[0] * shape[1]]]))
+    if len(counts) > 1 and counts[-1] == 0:
+        counts = counts[:-1]
+
+    return {'size': [int(shape[0]), int(shape[1])], 'counts': counts.tolist()}
+
+def crop_to_rle(crop, x0, y0, shape):
+    """Encode a mask crop as the COCO RLE of the full mask, without building the full mask.
+
+    Args:
+        crop (numpy.ndarray): The binary mask crop.
+        x0 (int): The column of the crop in the full mask.
+        y0 (int): The row of the crop in the full mask.
+        shape (list): The full mask size as [height, width].
+
+    Returns:
+        dict: The RLE with 'size' and (uncompressed) 'counts'.
+    """
+
+    crop_height = crop.shape[0] + 2
+    # Zero rows above and below, so that no run spans two columns of the crop.
+    padded = np.zeros([crop_height, crop.shape[1]], np.int8)
+    padded[1:-1] = crop
+    diff = np.diff(padded.T.ravel())
+    starts = np.flatnonzero(diff == 1) + 1
+    ends = np.flatnonzero(diff == -1) + 1
+    starts = (x0 + starts // crop_height) * shape[0] + y0 + starts % crop_height - 1
+    ends = (x0 + ends // crop_height) * shape[0] + y0 + ends % crop_height - 1
+
+    return runs_to_rle(starts, ends, shape)
+
 def polygon2shape(row):
     # shapes: (n_polygons, n_points, 2)
     shapes = [[[int(points[2*i]), int(points[2*i+1])] for i in range(len(points)//2)]
               for points in row.segmentation]
 
     return shapes
+
+class CocoJsonWriter(object):
+    """Write a coco annotation file incrementally.
+
+    The streamed arrays (images and annotations by default) are appended as JSON lines 
+    to ``<file_name>.<key>.part`` files as they are produced, and the final file is only 
+    assembled on close, so memory stays bounded regardless of the dataset size. The 
+    output is byte-for-byte what ``json.dump`` writes for the equivalent dict. If the 
+    run is interrupted, the parts are left on disk and can be assembled with 
+    ``CocoJsonWriter.recover``.
+
+    Args:
+        file_name (str): The coco annotation file to write.
+        fields (dict): All top-level fields in output order; the values of the 
+                       streamed keys are ignored.
+        stream_keys (tuple, optional): The keys of the arrays to stream. 
+                                       Defaults to ('images', 'annotations').
+    """
+
+    def __init__(self, file_name, fields, stream_keys=('images', 'annotations')):
+        self.file_name = file_name
+        self.counts = {key: 0 for key in stream_keys}
+        header = {key: [] if key in stream_keys else value for key, value in fields.items()}
+        with open(self._part_path(file_name, 'header'), 'w') as f:
+            json.dump(header, f)
+        self.part_files = {key: open(self._part_path(file_name, key), 'w') for key in stream_keys}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the parts on disk so that the partial output can be recovered.
+            for f in self.part_files.values():
+                f.close()
+
+    @staticmethod
+    def _part_path(file_name, key):
+        return '{0}.{1}.part'.format(file_name, key)
+
+    def append(self, key, item):
+        """Append an item to a streamed array.
+
+        Args:
+            key (str): The streamed key, e.g. 'images' or 'annotations'.
+            item (dict): The item to append.
+        """
+
+        with profiler.stage('write_json') as st:
+            line = json.dumps(item)
+            self.part_files[key].write(line)
+            self.part_files[key].write('\n')
+            if st:
+                st.add_bytes(len(line) + 1)
+        self.counts[key] += 1
+
+    def add_image(self, image):
+        self.append('images', image)
+
+    def add_annotation(self, annotation):
+        self.append('annotations', annotation)
+
+    def add_record(self, image, annotations):
+        """Append an image and its annotations."""
+
+        self.add_image(image)
+        for annotation in annotations:
+            self.add_annotation(annotation)
+
+    def close(self):
+        """Assemble the final coco file and remove the parts."""
+
+        for f in self.part_files.values():
+            f.close()
+        with profiler.stage('write_json'):
+            self.recover(self.file_name)
+
+    @classmethod
+    def recover(cls, file_name):
+        """Assemble a coco file from its parts, e.g. after an interrupted run.
+
+        A truncated last line of a part is dropped.
+
+        Args:
+            file_name (str): The coco annotation file to assemble.
+        """
+
+        header_path = cls._part_path(file_name, 'header')
+        with open(header_path, 'r') as f:
+            header = json.load(f)
+
+        part_paths = []
+        tmp_path = '{}.tmp'.format(file_name)
+        with open(tmp_path, 'w') as out:
+            out.write('{')
+            for i, (key, value) in enumerate(header.items()):
+                if i > 0:
+                    out.write(', ')
+                out.write('{}: '.format(json.dumps(key)))
+                part_path = cls._part_path(file_name, key)
+                if not os.path.exists(part_path):
+                    out.write(json.dumps(value))
+                    continue
+                part_paths.append(part_path)
+                out.write('[')
+                with open(part_path, 'r') as part:
+                    for j, line in enumerate(part):
+                        if not line.endswith('\n'):
+                            break
+                        if j > 0:
+                            out.write(', ')
+                        out.write(line[:-1])
+                out.write(']')
+            out.write('}')
+        os.replace(tmp_path, file_name)
+
+        for part_path in part_paths + [header_path]:
+            os.remove(part_path)
+
+COCO_OUTPUT_FORMATS = ['json', 'jsonl']
+
+def coco_shard_dir(file_name):
+    """Get the shard directory written instead of a coco file, e.g. train.json -> train.shards."""
+
+    return os.path.splitext(file_name)[0] + '.shards'
+
+class CocoShardWriter(object):
+    """Write a coco dataset as sharded JSON Lines.
+
+    Each line of a shard is one image with its annotations, ``{"image": {...}, 
+    "annotations": [...]}``, so that the shards can be read in parallel and streamed 
+    record by record. The shards are written to ``coco_shard_dir(file_name)``:
+
+    - ``shard-00000.jsonl``, ... with shard_size images each;
+    - ``shard-00000.index.json``, ... with the [id, file_name, byte offset] of each image 
+      of the shard;
+    - ``header.json``, written last, with the other top-level fields (categories...), the 
+      total counts and the list of shards.
+
+    The image file names stay relative to the directory of the coco file. The shards 
+    are converted back to a coco file by merge_coco_shards.
+
+    Args:
+        file_name (str): The coco annotation file the shards stand for.
+        fields (dict): All top-level fields in output order; the values of the 
+                       streamed keys are ignored.
+        shard_size (int, optional): Number of images per shard. Defaults to 1000.
+        stream_keys (tuple, optional): The keys of the images and annotations arrays. 
+                                       Defaults to ('images', 'annotations').
+    """
+
+    def __init__(self, file_name, fields, shard_size=1000, stream_keys=('images', 'annotations')):
+        self.shard_dir = coco_shard_dir(file_name)
+        self.shard_size = max(shard_size, 1)
+        self.stream_keys = stream_keys
+        self.counts = {key: 0 for key in stream_keys}
+        self.header = {key: [] if key in stream_keys else value for key, value in fields.items()}
+        self.shards = []
+        self.shard_file = None
+        self.shard_index = []
+        if os.path.exists(self.shard_dir):
+            shutil.rmtree(self.shard_dir)
+        os.makedirs(self.shard_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.shard_file is not None:
+            # Without the header, the partial shards are not taken for a complete dataset.
+            self.shard_file.close()
+
+    def _close_shard(self):
+        shard = self.shards[-1]
+        self.shard_file.close()
+        self.shard_file = None
+        index_path = os.path.join(self.shard_dir, shard['index'])
+        with open(index_path, 'w') as f:
+            json.dump({'images': self.shard_index}, f)
+        self.shard_index = []
+
+    def add_record(self, image, annotations):
+        """Append an image and its annotations.
+
+        Args:
+            image (dict): The image.
+            annotations (list): The annotations of the image.
+        """
+
+        images_key, annotations_key = self.stream_keys
+        if self.shard_file is None:
+            name = 'shard-{:05d}'.format(len(self.shards))
+            self.shards.append({'file': name + '.jsonl', 
+                                'index': name + '.index.json', 
+                                images_key: 0, 
+                                annotations_key: 0})
+            self.shard_file = open(os.path.join(self.shard_dir, name + '.jsonl'), 'wb')
+        with profiler.stage('write_json') as st:
+            line = json.dumps({'image': image, 'annotations': annotations}).encode('utf-8') + b'\n'
+            self.shard_index.append([image['id'], image['file_name'], self.shard_file.tell()])
+            self.shard_file.write(line)
+            if st:
+                st.add_bytes(len(line))
+        shard = self.shards[-1]
+        shard[images_key] += 1
+        shard[annotations_key] += len(annotations)
+        self.counts[images_key] += 1
+        self.counts[annotations_key] += len(annotations)
+        if shard[images_key] >= self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        """Finish the last shard and write the header."""
+
+        if self.shard_file is not None:
+            self._close_shard()
+        header = {'format': 'coco-shards', 
+                  'version': 1, 
+                  'fields': self.header, 
+                  'counts': self.counts, 
+                  'shards': self.shards}
+        header_path = os.path.join(self.shard_dir, 'header.json')
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(header_path + '.tmp', header_path)
+
+def open_coco_writer(file_name, fields, output_format='json', shard_size=1000):
+    """Open the writer of a coco dataset in one of COCO_OUTPUT_FORMATS.
+
+    Args:
+        file_name (str): The coco annotation file.
+        fields (dict): All top-level fields in output order.
+        output_format (str, optional): 'json' for a coco file (see CocoJsonWriter) or 
+                                       'jsonl' for sharded JSON Lines in coco_shard_dir(file_name) 
+                                       (see CocoShardWriter). Defaults to 'json'.
+        shard_size (int, optional): Number of images per shard. Defaults to 1000.
+
+    Returns:
+        CocoJsonWriter or CocoShardWriter: The writer.
+    """
+
+    if output_format == 'json':
+        return CocoJsonWriter(file_name, fields)
+    if output_format == 'jsonl':
+        return CocoShardWriter(file_name, fields, shard_size)
+    raise ValueError('Unknown output format {0}, expected one of {1}.'.format(output_format, 
+                                                                            COCO_OUTPUT_FORMATS))
+
+def read_shard_header(shard_dir):
+    """Read the header of sharded coco JSON Lines (see CocoShardWriter)."""
+
+    header_path = os.path.join(shard_dir, 'header.json')
+    if not os.path.exists(header_path):
+        raise ValueError('{} has no header.json, the shards are missing or incomplete.'.format(shard_dir))
+    with open(header_path, 'r') as f:
+        return json.load(f)
+
+def iter_coco_shard(shard_path):
+    """Iterate over the (image, annotations) records of one shard."""
+
+    with open(shard_path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            yield record['image'], record['annotations']
+
+def iter_coco_items(path):
+    """Iterate over the top-level values and array elements of a coco dataset.
+
+    Args:
+        path (str): A coco annotation file, or a directory of shards (see CocoShardWriter).
+
+    Yields:
+        tuple: (key, item) as iter_json_items does. For shards, the images and 
+               annotations are interleaved image by image.
+    """
+
+    if not os.path.isdir(path):
+        yield from iter_json_items(path)
+        return
+
+    header = read_shard_header(path)
+    images_key, annotations_key = list(header['counts'])
+    for key, value in header['fields'].items():
+        if key not in header['counts']:
+            if isinstance(value, list):
+                for item in value:
+                    yield key, item
+            else:
+                yield key, value
+    for shard in header['shards']:
+        for image, annotations in iter_coco_shard(os.path.join(path, shard['file'])):
+            yield images_key, image
+            for annotation in annotations:
+                yield annotations_key, annotation
+
+def merge_coco_shards(shard_dir, file_name):
+    """Concatenate sharded coco JSON Lines into a coco annotation file.
+
+    The file is the one CocoJsonWriter would have written for the same records.
+
+    Args:
+        shard_dir (str): The directory of shards.
+        file_name (str): The coco annotation file to write.
+
+    Returns:
+        dict: The number of images and annotations.
+    """
+
+    header = read_shard_header(shard_dir)
+    images_key, annotations_key = list(header['counts'])
+    with CocoJsonWriter(file_name, header['fields'], (images_key, annotations_key)) as writer:
+        for shard in header['shards']:
+            for image, annotations in iter_coco_shard(os.path.join(shard_dir, shard['file'])):
+                writer.append(images_key, image)
+                for annotation in annotations:
+                    writer.append(annotations_key, annotation)
+        counts = dict(writer.counts)
+    return counts
+
+def iter_json_items(json_path, chunk_size=1 << 20):
+    """Incrementally parse a JSON file whose top level is an object.
+
+    Only one chunk of the file and one array element are held in memory at a time, 
+    so multi-GB coco annotation files can be scanned without loading them whole.
+
+    Args:
+        json_path (str): The JSON file to parse.
+        chunk_size (int, optional): Number of characters read at a time. Defaults to 1 << 20.
+
+    Yields:
+        tuple: (key, item) for every element of a top-level array, and (key, value) 
+               for every other top-level value.
+    """
+
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+    delimiters = whitespace + ',:]}'
+    with open(json_path, 'r') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill(size=chunk_size):
+            nonlocal buf, pos, eof
+            chunk = f.read(size)
+            if not chunk:
+                eof = True
+                return False
+            buf = buf[pos:] + chunk
+            pos = 0
+            return True
+
+        def peek():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    raise ValueError('Unexpected end of {}.'.format(json_path))
+
+        def expect(char):
+            nonlocal pos
+            if peek() != char:
+                raise ValueError('Expected {0!r} at {1!r} in {2}.'.format(char, buf[pos:pos + 20], 
+                                                                        json_path))
+            pos += 1
+
+        def decode():
+            # Make sure the decoded value is followed by a delimiter so that numbers 
+            # or literals cut by the chunk boundary are not accepted. The reads double
+            # while a value spans several chunks, so that it is not decoded again and
+            # again for each chunk.
+            nonlocal pos
+            peek()
+            size = chunk_size
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if eof or (end < len(buf) and buf[end] in delimiters):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill(size)
+                size *= 2
+
+        expect('{')
+        if peek() == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            if peek() == '[':
+                pos += 1
+                if peek() == ']':
+                    pos += 1
+                else:
+                    while True:
+                        yield key, decode()
+                        if peek() == ']':
+                            pos += 1
+                            break
+                        expect(',')
+            else:
+                yield key, decode()
+            if peek() == '}':
+                return
+            expect(',')
+
+def parse_voc_xml(xml_path):
+    """Parse a VOC annotation file in a single pass.
+
+    Collects the file name, the image size and the name and bounding box of every 
+    object while the file is read, instead of querying the parsed tree per field.
+
+    Args:
+        xml_path (str): The VOC annotation file.
+
+    Returns:
+        dict: The 'filename', 'width', 'height' (None if missing) and 'objects' (list of 
+              [name, xmin, ymin, xmax, ymax]) of the annotation.
+    """
+
+    with profiler.stage('parse_xml') as st:
+        if st:
+            st.add_bytes(os.path.getsize(xml_path))
+        return _parse_voc_xml(xml_path)
+
+def _parse_voc_xml(xml_path):
+    fields = {'annotation/filename': 'filename', 
+              'annotation/size/width': 'width', 
+              'annotation/size/height': 'height'}
+    box_keys = ['xmin', 'ymin', 'xmax', 'ymax']
+    voc = {'filename': None, 'width': None, 'height': None, 'objects': []}
+    obj = None
+    path = []
+    for event, elem in ET.iterparse(xml_path, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem.tag)
+            if len(path) == 2 and elem.tag == 'object':
+                obj = {}
+            continue
+
+        tag_path = '/'.join(path)
+        if tag_path in fields:
+            voc[fields[tag_path]] = elem.text
+        elif len(path) >= 3 and path[1] == 'object':
+            if len(path) == 3 and elem.tag == 'name':
+                obj.setdefault('name', []).append(elem.text)
+            elif len(path) == 3 and elem.tag == 'bndbox':
+                obj.setdefault('bndbox', []).append(obj.pop('box', {}))
+            elif len(path) == 4 and path[2] == 'bndbox' and elem.tag in box_keys:
+                obj.setdefault('box', {}).setdefault(elem.tag, []).append(elem.text)
+        elif len(path) == 2 and elem.tag == 'object':
+            for tag in ['name', 'bndbox']:
+                if len(obj.get(tag, [])) != 1:
+                    raise NotImplementedError('The size of {0} is supposed to be 1, but is {1} in {2}.'.format(
+                        tag, len(obj.get(tag, [])), xml_path))
+            bndbox = obj['bndbox'][0]
+            for key in box_keys:
+                if len(bndbox.get(key, [])) != 1:
+                    raise NotImplementedError('The size of {0} is supposed to be 1, but is {1} in {2}.'.format(
+                        key, len(bndbox.get(key, [])), xml_path))
+            voc['objects'].append([obj['name'][0]] + [int(bndbox[key][0]) for key in box_keys])
+        path.pop()
+        if len(path) <= 1:
+            elem.clear()
+
+    if voc['filename'] is None:
+        raise NotImplementedError('Can not find filename in {}.'.format(xml_path))
+    for key in ['width', 'height']:
+        if voc[key] is not None:
+            voc[key] = int(voc[key])
+
+    return voc
+
+CocoAnnotation = collections.namedtuple('CocoAnnotation', 
+                                        ['category_id', 'iscrowd', 'bbox', 'segmentation'])
+
+def load_coco_index(json_path, keep_segmentation=True):
+    """Incrementally load a coco annotation file into a compact per-image index.
+
+    Args:
+        json_path (str): The coco annotation file (or a directory of shards, see 
+                         CocoShardWriter).
+        keep_segmentation (bool, optional): Keep the segmentation of the annotations, which 
+                                            dominates the memory usage. Defaults to True.
+
+    Returns:
+        tuple: The images ({id: (file_name, height, width)}), the categories ({id: name}) and 
+               the annotations of each image ({image_id: [CocoAnnotation]}) in file order.
+    """
+
+    with profiler.stage('load_json') as st:
+        if st and not os.path.isdir(json_path):
+            st.add_bytes(os.path.getsize(json_path))
+        return _load_coco_index(json_path, keep_segmentation)
+
+def _load_coco_index(json_path, keep_segmentation):
+    images = {}
+    categories = {}
+    annotations = collections.defaultdict(list)
+    for key, item in iter_coco_items(json_path):
+        if key == 'images':
+            images[item['id']] = (item['file_name'], item['height'], item['width'])
+        elif key == 'categories':
+            categories[item['id']] = item['name']
+        elif key == 'annotations':
+            segmentation = item.get('segmentation') if keep_segmentation else None
+            annotations[item['image_id']].append(CocoAnnotation(item['category_id'], 
+                                                                item.get('iscrowd', 0), 
+                                                                item.get('bbox'), 
+                                                                segmentation))
+
+    return images, categories, dict(annotations)
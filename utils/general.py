@@ -1,6 +1,17 @@
-import cv2
+import errno
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os
 import random
+import re
+import shutil
+
+from utils import profiler
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
 
 class ImageReader(object):
     def __init__(self, file_names):
@@ -40,20 +51,177 @@ class VideoReader(object):
             raise StopIteration
         return self.file_name, img
 
-def get_file_list(file_dir):
+class SampledVideoReader(object):
+    """Read only the selected frames of a video.
+
+    The frames to keep are given by an interval, a target frame rate or a list of 
+    timestamps. Skipped frames are passed with grab(), which avoids the conversion 
+    and copy of cap.read(), and gaps larger than seek_threshold frames are jumped by 
+    seeking, which decodes from the preceding keyframe only.
+
+    Args:
+        file_name (str): The file name of the video.
+        interval (int, optional): Keeps one frame in interval. Defaults to 1.
+        fps (float, optional): Target frame rate, overrides interval. Defaults to None.
+        timestamps (list, optional): Timestamps in seconds, overrides interval and fps. 
+                                     Defaults to None.
+        seek_threshold (int, optional): Minimum gap in frames to seek instead of grabbing 
+                                        (typically about a GOP). Defaults to 300.
+    """
+
+    def __init__(self, file_name, interval=1, fps=None, timestamps=None, seek_threshold=300):
+        self.file_name = file_name
+        self.interval = interval
+        self.fps = fps
+        self.timestamps = timestamps
+        self.seek_threshold = seek_threshold
+
+    def frame_ids(self, src_fps):
+        """Get the indices of the frames to keep in ascending order.
+
+        Args:
+            src_fps (float): The frame rate of the video.
+
+        Returns:
+            iterable: The frame indices (possibly unbounded).
+        """
+
+        if self.timestamps is not None:
+            return sorted(set(int(round(t * src_fps)) for t in self.timestamps if t >= 0))
+        if self.fps is not None and src_fps > 0:
+            step = src_fps / self.fps
+            ids = (int(k * step + 0.5) for k in itertools.count())
+            return (frame_id for frame_id, _ in itertools.groupby(ids))
+        return itertools.count(0, max(self.interval, 1))
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.file_name)
+        if not cap.isOpened():
+            raise IOError('Video {} cannot be opened'.format(self.file_name))
+        try:
+            pos = 0
+            for frame_id in self.frame_ids(cap.get(cv2.CAP_PROP_FPS)):
+                if frame_id - pos > self.seek_threshold:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+                    pos = frame_id
+                with profiler.stage('decode_frame') as st:
+                    while pos < frame_id:
+                        if not cap.grab():
+                            return
+                        pos += 1
+                    was_read, img = cap.read()
+                    if not was_read:
+                        return
+                    pos += 1
+                    if st:
+                        st.add_bytes(img.nbytes)
+                yield frame_id, img
+        finally:
+            cap.release()
+
+FILE_ORDERS = ['mtime', 'name', 'natural']
+
+def natural_key(name):
+    """Sort key comparing the digit runs of a name numerically (img2 < img10).
+
+    Args:
+        name (str): The file name.
+
+    Returns:
+        list: The sort key.
+    """
+
+    return [int(token) if token.isdigit() else token.lower() for token in re.split(r'(\d+)', name)]
+
+def _scan_dir(file_dir, need_mtime):
+    """List a directory with a single scandir pass.
+
+    Returns:
+        list: [name, is_file, mtime] of each entry (mtime is None if not needed).
+    """
+
+    entries = []
+    with os.scandir(file_dir) as it:
+        for entry in it:
+            mtime = entry.stat().st_mtime if need_mtime else None
+            entries.append([entry.name, entry.is_file(), mtime])
+    return entries
+
+def _cached_scan_dir(file_dir, need_mtime, cache_dir):
+    """List a directory, reusing the persisted listing if the directory mtime is unchanged.
+
+    Returns:
+        list: [name, is_file, mtime] of each entry.
+    """
+
+    dir_path = os.path.abspath(file_dir)
+    dir_mtime = os.stat(dir_path).st_mtime_ns
+    cache_path = os.path.join(cache_dir, 
+                              '{}.json'.format(hashlib.sha1(dir_path.encode('utf-8')).hexdigest()))
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache['dir'] == dir_path and cache['dir_mtime_ns'] == dir_mtime and \
+           (cache['has_mtime'] or not need_mtime):
+            return cache['entries']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    entries = _scan_dir(dir_path, need_mtime)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = '{0}.{1}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump({'dir': dir_path, 'dir_mtime_ns': dir_mtime, 'has_mtime': need_mtime, 
+                   'entries': entries}, f)
+    os.replace(tmp_path, cache_path)
+    return entries
+
+def get_file_list(file_dir, exts=None, order='mtime', files_only=False, cache_dir=None):
     """Get the files in the directory and sort them in ascending order of file modification time.
 
+    The directory is read with a single os.scandir pass, whose entries already know 
+    their type; the modification times are only queried for the 'mtime' order.
+
     Args:
         file_dir (str): The directory of files.
+        exts (list, optional): Only keep the files with these extensions (case-insensitive, 
+                               e.g. ['jpg', 'png']). Defaults to None (all files).
+        order (str, optional): 'mtime', 'name' or 'natural' (numbers compared numerically). 
+                               Defaults to 'mtime'.
+        files_only (bool, optional): Skip directories and other non-regular entries. 
+                                     Defaults to False.
+        cache_dir (str, optional): Directory of the persisted listing cache, reused while the 
+                                   directory mtime is unchanged (note that modifying a file in 
+                                   place does not change it). Defaults to None (no cache).
 
     Returns:
         list: The sorted list of files in the directory.
     """    
 
-    file_list = os.listdir(file_dir)
+    if order not in FILE_ORDERS:
+        raise ValueError('Unknown order {0}, expected one of {1}.'.format(order, FILE_ORDERS))
+
+    need_mtime = order == 'mtime'
+    if cache_dir is not None:
+        entries = _cached_scan_dir(file_dir, need_mtime, cache_dir)
+    else:
+        entries = _scan_dir(file_dir, need_mtime)
+
+    if files_only:
+        entries = [entry for entry in entries if entry[1]]
+    if exts is not None:
+        exts = tuple('.{}'.format(ext.lower().lstrip('.')) for ext in exts)
+        entries = [entry for entry in entries if entry[0].lower().endswith(exts)]
+
+    if order == 'mtime':
+        entries.sort(key=lambda entry: entry[2])
+    elif order == 'name':
+        entries.sort(key=lambda entry: entry[0])
+    else:
+        entries.sort(key=lambda entry: natural_key(entry[0]))
 
-    return sorted(file_list, 
-                  key=lambda x: os.path.getmtime(os.path.join(file_dir, x))) if file_list else []
+    return [entry[0] for entry in entries]
 
 def random_index(rate):
     """Randomly select the category index based on the percentage probability.
@@ -98,4 +266,104 @@ def get_xml_elements(root, tag, length=-1):
     if length == 1:
         vars = vars[0]
 
-    return vars
\ No newline at end of file
+    return vars
+
+def parallel_imap(func, iterable, workers=1, chunksize=1):
+    """Apply a function to every item, optionally across a process pool.
+
+    Results are yielded in input order either way, so the caller can assign ids 
+    deterministically while the items are processed in parallel.
+
+    Args:
+        func (callable): A picklable function taking one item.
+        iterable (iterable): The items to process.
+        workers (int, optional): Number of worker processes, runs in the current 
+                                 process if not greater than 1. Defaults to 1.
+        chunksize (int, optional): Number of items sent to a worker at once. Defaults to 1.
+
+    Yields:
+        The result of func for each item.
+    """
+
+    if workers is None or workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    profiled = profiler.is_enabled()
+    if profiled:
+        # The stats of the workers are sent back with the results.
+        func = profiler.ProfiledCall(func)
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap(func, iterable, chunksize):
+            if profiled:
+                result, stats = result
+                profiler.merge(stats)
+            yield result
+
+MATERIALIZE_MODES = ['copy', 'hardlink', 'reflink', 'symlink']
+
+# Errors meaning that the link can not be created here, e.g. across filesystems.
+_LINK_FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.EINVAL, 
+                         errno.ENOTTY, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+def _reflink(src, dst):
+    """Clone src to dst sharing the data blocks (Linux FICLONE, e.g. on btrfs/XFS)."""
+
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported on this platform.')
+
+    ficlone = 0x40049409
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), ficlone, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copymode(src, dst)
+
+def materialize(src, dst, mode='copy'):
+    """Make the file src available at dst by copying or linking it.
+
+    Linking falls back to a copy when it is not possible, e.g. a hardlink or a 
+    reflink across filesystems.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file, replaced if it exists.
+        mode (str, optional): One of MATERIALIZE_MODES. Defaults to 'copy'.
+
+    Returns:
+        str: The destination file.
+    """
+
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError('Unknown materialize mode {0}, expected one of {1}.'.format(mode, 
+                                                                                   MATERIALIZE_MODES))
+    with profiler.stage('materialize') as st:
+        if st:
+            st.add_bytes(os.path.getsize(src))
+        return _materialize(src, dst, mode)
+
+def _materialize(src, dst, mode):
+    # A previous run may have left a link at dst, which a copy would write through
+    # (overwriting its source). Copying a file onto itself still raises SameFileError.
+    if os.path.lexists(dst) and os.path.abspath(dst) != os.path.abspath(src):
+        os.remove(dst)
+    if mode != 'copy':
+        try:
+            if mode == 'hardlink':
+                os.link(src, dst)
+            elif mode == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            elif mode == 'reflink':
+                _reflink(src, dst)
+            return dst
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK_ERRNOS:
+                raise
+
+    return shutil.copy(src, dst)
@@ -1,9 +1,52 @@
+import functools
+import itertools
 import os
-import imageio
-from PIL import Image
-from tqdm import tqdm
-import cv2
-from utils.general import get_file_list
+import queue
+import threading
+import time
+from utils import profiler
+from utils.general import get_file_list, parallel_imap
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+GifImagePlugin = lazy_import('PIL.GifImagePlugin')
+tqdm = lazy_import('tqdm')
+cv2 = lazy_import('cv2')
+
+JPG_STATUSES = ['ok', 'not_jpg', 'truncated', 'unreadable']
+
+# The extensions of the files taken as images when listing a directory.
+IMG_EXTS = ['jpg', 'jpeg', 'png', 'bmp', 'tif', 'tiff', 'webp']
+
+def check_jpg(filename):
+    """Check a jpg file by its magic bytes, without decoding it.
+
+    Only the first and last bytes of the file are read: a jpg starts with the SOI 
+    marker and a complete one ends with the EOI marker (possibly followed by padding).
+
+    Args:
+        filename (str): The filename to check.
+
+    Returns:
+        str: 'ok', 'not_jpg', 'truncated' or 'unreadable'.
+    """
+
+    with profiler.stage('check_image'):
+        return _check_jpg(filename)
+
+def _check_jpg(filename):
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(3) != b'\xff\xd8\xff':
+                return 'not_jpg'
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - 1024, 0))
+            tail = f.read()
+    except OSError:
+        return 'unreadable'
+
+    return 'ok' if b'\xff\xd9' in tail else 'truncated'
 
 def is_jpg(filename):
     """Check if the image format is jpg.
@@ -15,25 +58,385 @@ def is_jpg(filename):
         bool: if the image format is jpg.
     """
 
-    try:
-        img = Image.open(filename)
-        return img.format =='JPEG'
-    except IOError:
-        return False
+    return check_jpg(filename) in ['ok', 'truncated']
+
+def validate_images(img_dir, workers=1):
+    """Check all jpg files in a directory up front.
+
+    Args:
+        img_dir (str): The directory of images.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+
+    Returns:
+        dict: The status (see check_jpg) of each file name in the directory.
+    """
+
+    with os.scandir(img_dir) as it:
+        file_names = sorted(entry.name for entry in it if entry.is_file())
+    file_paths = [os.path.join(img_dir, file_name) for file_name in file_names]
+
+    return dict(zip(file_names, parallel_imap(check_jpg, file_paths, workers, chunksize=256)))
+
+class AsyncImageWriter(object):
+    """Encode and write images in background threads.
+
+    Images are put on a bounded queue and encoded by encoder threads (cv2.imwrite 
+    releases the GIL), so that decoding or capturing is not stalled by encoding. 
+    When the queue is full, write() blocks (or drops the image if block is False) 
+    and the time spent waiting is recorded in the backpressure statistics.
+
+    Args:
+        num_threads (int, optional): Number of encoder threads. Defaults to 2.
+        max_queue (int, optional): Maximum number of pending images. Defaults to 64.
+        img_format (str, optional): Replaces the extension of the written files 
+                                    (e.g. 'jpg', 'png'). Defaults to None.
+        quality (int, optional): JPEG/WebP quality (0-100) or PNG compression level (0-9). 
+                                 Defaults to None (OpenCV default).
+        block (bool, optional): Wait for a free slot when the queue is full instead of 
+                                dropping the image. Defaults to True.
+    """
+
+    def __init__(self, num_threads=2, max_queue=64, img_format=None, quality=None, block=True):
+        self.img_format = img_format
+        self.quality = quality
+        self.block = block
+        self.queue = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.errors = []
+        self.stats = {'queued': 0, 'written': 0, 'failed': 0, 'dropped': 0, 
+                      'blocked': 0, 'blocked_time': 0.0, 'max_depth': 0}
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An encoder error must not replace the exception raised in the with block.
+        self.close(raise_errors=exc_type is None)
+
+    def _params(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        if self.quality is None:
+            return []
+        if ext in ['.jpg', '.jpeg']:
+            return [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)]
+        if ext == '.webp':
+            return [cv2.IMWRITE_WEBP_QUALITY, int(self.quality)]
+        if ext == '.png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, int(self.quality)]
+        return []
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, img = item
+            try:
+                with profiler.stage('encode_image', img.nbytes):
+                    ok = cv2.imwrite(path, img, self._params(path))
+                with self.lock:
+                    self.stats['written' if ok else 'failed'] += 1
+            except Exception as e:
+                with self.lock:
+                    self.stats['failed'] += 1
+                    self.errors.append(e)
+
+    def write(self, path, img):
+        """Queue an image for writing.
+
+        Args:
+            path (str): The output path, with an extension (replaced by the configured 
+                        format, if any).
+            img (numpy.ndarray): The BGR image.
+
+        Returns:
+            str: The output path (with the configured format), or None if dropped.
+        """
+
+        if self.img_format is not None:
+            path = '{0}.{1}'.format(os.path.splitext(path)[0], self.img_format)
+        item = (path, img)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if not self.block:
+                with self.lock:
+                    self.stats['dropped'] += 1
+                return None
+            start = time.perf_counter()
+            self.queue.put(item)
+            with self.lock:
+                self.stats['blocked'] += 1
+                self.stats['blocked_time'] += time.perf_counter() - start
+        with self.lock:
+            self.stats['queued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+
+        return path
+
+    def close(self, raise_errors=True):
+        """Wait until all queued images are written and stop the encoder threads.
+
+        Args:
+            raise_errors (bool, optional): Raise the first error of the encoder threads. 
+                                           Defaults to True.
+        """
+
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.errors and raise_errors:
+            raise self.errors[0]
+
+    def summary(self):
+        """Get a one-line summary of the writer statistics.
+
+        Returns:
+            str: The summary.
+        """
+
+        return ('Written: {written}, failed: {failed}, dropped: {dropped}, '
+                'blocked: {blocked} times ({blocked_time:.2f} s), max queue depth: {max_depth}'
+                ).format(**self.stats)
+
+def get_img_paths(img_dir, order='mtime', exclude=None, cache_dir=None):
+    """Get the paths of the images (files with IMG_EXTS) in a directory in the order of get_file_list.
+
+    Args:
+        img_dir (str): The directory of images.
+        order (str, optional): 'mtime', 'name' or 'natural'. Defaults to 'mtime'.
+        exclude (list, optional): Paths to skip, e.g. the output file when it is written 
+                                  into img_dir. Defaults to None.
+        cache_dir (str, optional): Directory of the persisted listing cache (see get_file_list). 
+                                   Defaults to None (no cache).
+
+    Returns:
+        list: The image paths.
+    """
+
+    exclude = {os.path.abspath(path) for path in exclude or []}
+    img_names = get_file_list(img_dir, exts=IMG_EXTS, order=order, files_only=True, 
+                              cache_dir=cache_dir)
+    img_paths = [os.path.join(img_dir, img_name) for img_name in img_names]
+    return [img_path for img_path in img_paths if os.path.abspath(img_path) not in exclude]
+
+def open_thumbnail(img_path, img_size=None):
+    """Open an image shrunk to fit in img_size, keeping the aspect ratio.
+
+    Image.thumbnail decodes JPEG sources directly at a reduced scale (PIL draft mode) 
+    when the image is much larger than img_size, keeping at least twice img_size before 
+    the final resampling so that the quality is preserved.
 
-def create_gif(save_path, img_dir, duration=0.1):
+    Args:
+        img_path (str): The image path.
+        img_size (tuple, optional): The maximum (width, height). Defaults to None (original size).
+
+    Returns:
+        PIL.Image.Image: The image.
+    """
+
+    img = Image.open(img_path)
+    if img_size is not None:
+        img.thumbnail(img_size)
+    return img
+
+def load_frame(img_path, img_size=None):
+    """Decode an image and shrink it to fit in img_size, keeping the aspect ratio.
+
+    Args:
+        img_path (str): The image path.
+        img_size (tuple, optional): The maximum (width, height). Defaults to None (original size).
+
+    Returns:
+        PIL.Image.Image: The RGB frame.
+    """
+
+    with profiler.stage('decode_image') as st:
+        if st:
+            st.add_bytes(os.path.getsize(img_path))
+        return open_thumbnail(img_path, img_size).convert('RGB')
+
+def iter_path_frames(img_paths, img_size=None, pbar_desc='Processing'):
+    """Decode and resize images one at a time, without intermediate files.
+
+    Args:
+        img_paths (list): The image paths.
+        img_size (tuple, optional): The maximum (width, height). Defaults to None.
+        pbar_desc (str, optional): The progress bar description. Defaults to 'Processing'.
+
+    Yields:
+        PIL.Image.Image: The RGB frames.
+    """
+
+    pbar = tqdm.tqdm(img_paths)
+    for img_path in pbar:
+        pbar.set_description('{0}: {1}'.format(pbar_desc, img_path))
+        yield load_frame(img_path, img_size)
+
+def iter_frames(img_source, img_size=None, pbar_desc='Processing', order='mtime', exclude=None, 
+                cache_dir=None):
+    """Stream frames decoded and resized in memory, without intermediate files.
+
+    Args:
+        img_source (str or iterable): A directory of images, or frames (PIL images or 
+                                      RGB arrays) which are passed through.
+        img_size (tuple, optional): The maximum (width, height). Defaults to None.
+        pbar_desc (str, optional): The progress bar description. Defaults to 'Processing'.
+        order (str, optional): The order of the images in a directory ('mtime', 'name' or 
+                               'natural'). Defaults to 'mtime'.
+        exclude (list, optional): Paths in the directory to skip. Defaults to None.
+        cache_dir (str, optional): Directory of the persisted listing cache. Defaults to None.
+
+    Returns:
+        iterable: The frames.
+    """
+
+    if isinstance(img_source, str):
+        img_paths = get_img_paths(img_source, order, exclude, cache_dir)
+        return iter_path_frames(img_paths, img_size, pbar_desc)
+    return iter(img_source)
+
+def build_gif_palette(frames, n_colors=256, tile_size=(128, 128)):
+    """Compute one global palette from a few sample frames.
+
+    Args:
+        frames (list): The sample frames (PIL images or RGB arrays).
+        n_colors (int, optional): The palette size. Defaults to 256.
+        tile_size (tuple, optional): The size each sample is shrunk to. Defaults to (128, 128).
+
+    Returns:
+        PIL.Image.Image: A 'P' image holding the palette.
+    """
+
+    tiles = []
+    for frame in frames:
+        tile = frame if isinstance(frame, Image.Image) else Image.fromarray(np.asarray(frame))
+        tile = tile.convert('RGB')
+        tile.thumbnail(tile_size)
+        tiles.append(tile)
+
+    mosaic = Image.new('RGB', (tile_size[0] * max(len(tiles), 1), tile_size[1]))
+    for i, tile in enumerate(tiles):
+        mosaic.paste(tile, (i * tile_size[0], 0))
+    return mosaic.quantize(n_colors)
+
+def fit_to_canvas(frame, canvas_size):
+    """Shrink a frame to fit in canvas_size (keeping its aspect ratio) and center it on a black canvas.
+
+    Args:
+        frame (PIL.Image.Image): The RGB frame.
+        canvas_size (tuple): The canvas (width, height).
+
+    Returns:
+        PIL.Image.Image: The frame, as is if it already has the canvas size.
+    """
+
+    canvas_size = tuple(canvas_size)
+    if frame.size == canvas_size:
+        return frame
+    frame = frame.copy()
+    frame.thumbnail(canvas_size)
+    canvas = Image.new('RGB', canvas_size)
+    canvas.paste(frame, ((canvas_size[0] - frame.size[0]) // 2, (canvas_size[1] - frame.size[1]) // 2))
+    return canvas
+
+def create_gif(save_path, img_source, duration=0.1, img_size=None, frame_skip=1, max_frames=None, 
+               palette_samples=16, loop=0, order='mtime', cache_dir=None):
     """Create a gif file from images.
 
+    Frames are quantized to one global palette computed from a sample of the frames 
+    and appended to the file one at a time, so the memory usage does not depend on 
+    the number of frames. All the frames are centered on a canvas of img_size (or of the 
+    size of the first frame), since a gif frame must fit in the logical screen.
+
     Args:
-        file_name (str): The name of the gif file to create.
-        img_dir (str): The directory of the source images.
-        duration (float, optional): The frame duration of the gif file. Defaults to 0.1.
+        save_path (str): The name of the gif file to create.
+        img_source (str or iterable): The directory of the source images, or the frames.
+        duration (float, optional): The frame duration (seconds) of the gif file. Defaults to 0.1.
+        img_size (tuple, optional): The maximum size of the frames. Defaults to None.
+        frame_skip (int, optional): Keeps one frame in frame_skip. Defaults to 1.
+        max_frames (int, optional): The maximum number of frames. Defaults to None.
+        palette_samples (int, optional): Number of frames sampled for the palette. Defaults to 16.
+        loop (int, optional): Number of loops, 0 loops forever. Defaults to 0.
+        order (str, optional): The order of the images in the directory ('mtime', 'name' or 
+                               'natural'). Defaults to 'mtime'.
+        cache_dir (str, optional): Directory of the persisted listing cache of the image 
+                                   directory. Defaults to None.
     """    
 
-    frames = [imageio.imread(os.path.join(img_dir, _)) for _ in get_file_list(img_dir)]
-    imageio.mimsave(save_path, frames, 'GIF', duration=duration)
+    frame_skip = max(frame_skip, 1)
+    if isinstance(img_source, str):
+        # The gif may be written into the image directory (and exist from a previous run).
+        img_paths = get_img_paths(img_source, order, [save_path], cache_dir)[::frame_skip][:max_frames]
+        step = max(len(img_paths) // max(palette_samples, 1), 1)
+        samples = [load_frame(img_path, img_size) for img_path in img_paths[::step][:palette_samples]]
+        frames = iter_path_frames(img_paths, img_size)
+    else:
+        frames = itertools.islice(iter(img_source), 0, None, frame_skip)
+        frames = itertools.islice(frames, max_frames)
+        # Frames can only be read once, so the first ones are sampled and kept.
+        samples = list(itertools.islice(frames, palette_samples))
+        frames = itertools.chain(samples, frames)
+    if len(samples) == 0:
+        raise ValueError('No frames to write to {}.'.format(save_path))
+    palette = build_gif_palette(samples)
+
+    canvas_size = img_size
+    with open(save_path, 'wb') as fp:
+        for i, frame in enumerate(frames):
+            with profiler.stage('encode_gif'):
+                if not isinstance(frame, Image.Image):
+                    frame = Image.fromarray(np.asarray(frame))
+                frame = frame.convert('RGB')
+                if canvas_size is None:
+                    canvas_size = frame.size
+                frame = fit_to_canvas(frame, canvas_size).quantize(palette=palette)
+                if i == 0:
+                    header, _ = GifImagePlugin.getheader(frame, info={'loop': loop, 'optimize': False})
+                    fp.write(b''.join(header))
+                fp.write(b''.join(GifImagePlugin.getdata(frame, duration=duration * 1000)))
+        fp.write(b';')  # trailer
+
+def convert_one_img(img_path, save_dir, img_size, target_type='png', quality=None):
+    """Convert an image to specified type.
+
+    Args:
+        img_path (str): The image path.
+        save_dir (str): Save directory of output image.
+        img_size (tuple): The size of output image.
+        target_type (str, optional): The target image type to convert. Defaults to 'png'.
+        quality (int, optional): The output quality (JPEG/WebP). Defaults to None.
 
-def convert_img(img_source, save_dir, img_size, target_type='png'):
+    Returns:
+        str: The output path.
+    """
+
+    with profiler.stage('decode_image') as st:
+        if st:
+            st.add_bytes(os.path.getsize(img_path))
+        img = open_thumbnail(img_path, img_size)
+        if target_type.lower() in ['jpg', 'jpeg'] and img.mode not in ['RGB', 'L', 'CMYK']:
+            img = img.convert('RGB')
+        else:
+            img.load()
+    save_path = os.path.join(save_dir, 
+                             '{0}.{1}'.format(os.path.splitext(os.path.split(img_path)[1])[0], 
+                                              target_type))
+    params = {} if quality is None else {'quality': quality}
+    with profiler.stage('encode_image') as st:
+        img.save(save_path, **params)
+        if st:
+            st.add_bytes(os.path.getsize(save_path))
+
+    return save_path
+
+def convert_img(img_source, save_dir, img_size, target_type='png', quality=None, workers=1, 
+                cache_dir=None):
     """Convert image(s) to specified type.
 
     Args:
@@ -41,44 +444,60 @@ def convert_img(img_source, save_dir, img_size, target_type='png'):
         save_dir (str): Save directory of output image(s).
         img_size (tuple): The size of output image(s)。
         target_type (str, optional): The target image type to convert. Defaults to 'png'.
+        quality (int, optional): The output quality (JPEG/WebP). Defaults to None.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        cache_dir (str, optional): Directory of the persisted listing cache of the image 
+                                   directory. Defaults to None.
     """    
 
+    worker = functools.partial(convert_one_img, 
+                               save_dir=save_dir, 
+                               img_size=img_size, 
+                               target_type=target_type, 
+                               quality=quality)
     if os.path.isdir(img_source):
-        pbar = tqdm(get_file_list(img_source))
-        for img_name in pbar:
-            img_path = os.path.join(img_source, img_name)
-            if not os.path.isfile(img_path):
-                continue
-            pbar.set_description('Converting: {}'.format(img_path))
-            img = Image.open(img_path)
-            img.thumbnail((img_size))
-            img.save(os.path.join(save_dir, 
-                                  '{0}.{1}'.format(os.path.splitext(img_name)[0], 
-                                                   target_type)))
+        img_paths = get_img_paths(img_source, cache_dir=cache_dir)
+        pbar = tqdm.tqdm(parallel_imap(worker, img_paths, workers, chunksize=8), total=len(img_paths))
+        for save_path in pbar:
+            pbar.set_description('Converted: {}'.format(save_path))
     elif os.path.isfile(img_source):
-        img = Image.open(img_source)
-        img.thumbnail((img_size))
-        img.save(os.path.join(save_dir, 
-                              '{0}.{1}'.format(os.path.splitext(os.path.split(img_source)[1])[0], 
-                                                                target_type)))
+        worker(img_source)
 
-def create_video(save_path, img_dir, fps, img_size):
+def create_video(save_path, img_source, fps, img_size, order='mtime', cache_dir=None):
     """Create a video file from images.
 
+    Frames smaller than img_size (after keeping their aspect ratio) are centered on 
+    a black canvas, since the video writer only accepts frames of img_size.
+
     Args:
-        file_name (str): The name of the video file to create.
-        img_dir (str): The directory of the source images.
+        save_path (str): The name of the video file to create.
+        img_source (str or iterable): The directory of the source images, or the frames.
         fps (float): The frame rate of the video file.
         img_size (tuple): The size of converted images.
+        order (str, optional): The order of the images in the directory ('mtime', 'name' or 
+                               'natural'). Defaults to 'mtime'.
+        cache_dir (str, optional): Directory of the persisted listing cache of the image 
+                                   directory. Defaults to None.
     """    
 
+    # The images are listed before the video file is created, which may be in the directory.
+    frames = iter_frames(img_source, img_size, order=order, exclude=[save_path], 
+                         cache_dir=cache_dir)
     fourcc = cv2.VideoWriter_fourcc('m','p','4', 'v')
     video  = cv2.VideoWriter(save_path, fourcc, fps, img_size)
-    pbar = tqdm(get_file_list(img_dir))
-    for img_name in pbar:
-        img_path = os.path.join(img_dir, img_name)
-        pbar.set_description('Processing: {}'.format(img_path))
-        frame = cv2.imread(img_path)
-        video.write(frame)
+    for frame in frames:
+        with profiler.stage('encode_video'):
+            frame = cv2.cvtColor(np.asarray(frame), cv2.COLOR_RGB2BGR)
+            h, w = frame.shape[:2]
+            if (w, h) != tuple(img_size):
+                scale = min(img_size[0] / w, img_size[1] / h, 1)
+                if scale < 1:
+                    w, h = max(int(w * scale), 1), max(int(h * scale), 1)
+                    frame = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+                canvas = np.zeros((img_size[1], img_size[0], 3), np.uint8)
+                x, y = (img_size[0] - w) // 2, (img_size[1] - h) // 2
+                canvas[y:y+h, x:x+w] = frame
+                frame = canvas
+            video.write(frame)
 
     video.release()
@@ -0,0 +1,58 @@
+import importlib
+import importlib.util
+import sys
+import types
+
+class _LazySubmodule(types.ModuleType):
+    """Stand-in for a submodule (e.g. 'PIL.Image') imported on the first attribute access.
+
+    Finding the spec of a submodule imports its parent package, so unlike top-level
+    modules, submodules cannot be set up with LazyLoader without paying for the parent.
+    """
+
+    def _load(self):
+        module = self.__dict__.get('_module')
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+def lazy_import(name):
+    """Import a module that is only loaded on the first access to one of its attributes.
+
+    The heavy dependencies (cv2, numpy, PIL, pycocotools, labelme...) are imported this
+    way, so that the tools can parse their arguments (and print --help) without paying
+    for the dependencies they do not use. A missing top-level package still fails here,
+    a missing submodule on first use.
+
+    Args:
+        name (str): The full name of the module, e.g. 'PIL.Image'.
+
+    Returns:
+        module: The module (the loaded one if it was already imported).
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+    top_level = name.partition('.')[0]
+    if top_level not in sys.modules and importlib.util.find_spec(top_level) is None:
+        raise ImportError('No module named {!r}'.format(top_level), name=top_level)
+    if top_level != name:
+        return _LazySubmodule(name)
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+
+def file_states(paths):
+    """Get the (mtime, size) state of files.
+
+    Args:
+        paths (list): The file paths.
+
+    Returns:
+        list: [mtime_ns, size] of each file, None for a missing file.
+    """
+
+    states = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            states.append([st.st_mtime_ns, st.st_size])
+        except OSError:
+            states.append(None)
+    return states
+
+def hash_files(paths, chunk_size=1 << 20):
+    """Hash the contents of files together.
+
+    Args:
+        paths (list): The file paths.
+        chunk_size (int, optional): Number of bytes read at a time. Defaults to 1 << 20.
+
+    Returns:
+        str: The sha1 hex digest (missing files are hashed as such).
+    """
+
+    sha1 = hashlib.sha1()
+    for path in paths:
+        sha1.update(path.encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    sha1.update(chunk)
+        except OSError:
+            sha1.update(b'\0missing')
+        sha1.update(b'\0')
+    return sha1.hexdigest()
+
+def file_signature(paths):
+    """Get the signature of the source files of a converted item.
+
+    Args:
+        paths (list): The source file paths.
+
+    Returns:
+        dict: The 'paths', their 'states' and the content 'sha1'.
+    """
+
+    return {'paths': list(paths), 'states': file_states(paths), 'sha1': hash_files(paths)}
+
+class ConversionManifest(object):
+    """Track the source files of a conversion and cache the converted fragments.
+
+    The manifest records, for each source key (e.g. an annotation file name), the 
+    state and content hash of its source files, the stable id assigned to it and 
+    the output files it produced; the converted fragment of each key is cached as 
+    a JSON file, so that unchanged sources are not converted again. A source whose 
+    mtime or size changed but whose content hash is the same is still current.
+
+    The manifest and fragments are stored in cache_dir. If the conversion config 
+    differs from the stored one, all cached entries are dropped.
+
+    Args:
+        cache_dir (str): The cache directory.
+        config (dict): The conversion parameters the fragments depend on.
+        start_id (int, optional): The first id to assign. Defaults to 0.
+    """
+
+    def __init__(self, cache_dir, config, start_id=0):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, 'manifest.json')
+        self.config = json.loads(json.dumps(config))
+        self.stale = []
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        if data.get('config') == self.config:
+            self.entries = data['entries']
+            self.next_id = data['next_id']
+        else:
+            # Outputs of a conversion with other parameters can not be reused.
+            self.stale = list(data.get('entries', {}).values())
+            self.entries = {}
+            self.next_id = start_id
+
+    def _fragment_path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'fragments', name[:2], '{}.json'.format(name))
+
+    def is_current(self, key):
+        """Check if the sources of a key are unchanged since they were converted.
+
+        Args:
+            key (str): The source key.
+
+        Returns:
+            bool: If the cached fragment can be reused.
+        """
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        states = file_states(entry['paths'])
+        if states == entry['states']:
+            return True
+        if hash_files(entry['paths']) == entry['sha1']:
+            entry['states'] = states
+            return True
+        return False
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def assign_id(self, key):
+        """Get the id of a key, a new one if it has none.
+
+        Args:
+            key (str): The source key.
+
+        Returns:
+            int: The id.
+        """
+
+        entry = self.entries.get(key)
+        if entry is not None and entry.get('id') is not None:
+            return entry['id']
+        item_id = self.next_id
+        self.next_id += 1
+        return item_id
+
+    def load_fragment(self, key):
+        with open(self._fragment_path(key), 'r') as f:
+            return json.load(f)
+
+    def update(self, key, signature, fragment, item_id=None, outputs=()):
+        """Record the conversion of a key.
+
+        Args:
+            key (str): The source key.
+            signature (dict): The signature of the source files (see file_signature).
+            fragment: The JSON serializable converted fragment.
+            item_id (int, optional): The id assigned to the key. Defaults to None.
+            outputs (list, optional): The output files produced. Defaults to ().
+
+        Returns:
+            list: The output files of the previous conversion that are not produced anymore.
+        """
+
+        fragment_path = self._fragment_path(key)
+        if not os.path.exists(os.path.dirname(fragment_path)):
+            os.makedirs(os.path.dirname(fragment_path))
+        with open(fragment_path, 'w') as f:
+            json.dump(fragment, f)
+
+        old_entry = self.entries.get(key, {})
+        self.entries[key] = dict(signature, id=item_id, outputs=list(outputs))
+        return [path for path in old_entry.get('outputs', []) if path not in outputs]
+
+    def remove_missing(self, keys):
+        """Drop the keys whose sources are gone.
+
+        Args:
+            keys (list): The current source keys.
+
+        Returns:
+            list: The output files of the dropped keys (and of the dropped stale entries).
+        """
+
+        keys = set(keys)
+        outputs = [path for entry in self.stale for path in entry.get('outputs', [])]
+        self.stale = []
+        for key in [key for key in self.entries if key not in keys]:
+            outputs.extend(self.entries.pop(key).get('outputs', []))
+            fragment_path = self._fragment_path(key)
+            if os.path.exists(fragment_path):
+                os.remove(fragment_path)
+        return outputs
+
+    def save(self):
+        """Write the manifest (atomically)."""
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'config': self.config, 'next_id': self.next_id, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+def remove_files(paths):
+    """Remove the output files that are not produced anymore.
+
+    Args:
+        paths (list): The file paths, missing ones are ignored.
+    """
+
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+
+# Stage name -> [count, seconds, bytes], only filled while profiling is enabled.
+_stats = {}
+_lock = threading.Lock()
+_enabled = False
+_start_time = None
+
+class _NullStage(object):
+    """The stage returned while profiling is disabled: does nothing and is falsy."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _Stage(object):
+    """Time a block of code and record it under a stage name."""
+
+    __slots__ = ['name', 'nbytes', 'start']
+
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start, 1, self.nbytes)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+def enable(enabled=True):
+    """Enable (or disable) profiling and restart the wall clock."""
+
+    global _enabled, _start_time
+    _enabled = enabled
+    _start_time = time.perf_counter()
+
+def is_enabled():
+    return _enabled
+
+def stage(name, nbytes=0):
+    """Time a block of code as a stage, e.g. ``with profiler.stage('parse_xml'):``.
+
+    While profiling is disabled, a shared no-op (falsy) stage is returned, so that
+    computing the number of bytes can be skipped with ``if st: st.add_bytes(...)``.
+
+    Args:
+        name (str): The stage name.
+        nbytes (int, optional): The number of bytes processed. Defaults to 0.
+
+    Returns:
+        The context manager of the stage.
+    """
+
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, nbytes)
+
+def record(name, seconds, count=1, nbytes=0):
+    """Add a measurement to a stage."""
+
+    with _lock:
+        entry = _stats.setdefault(name, [0, 0.0, 0])
+        entry[0] += count
+        entry[1] += seconds
+        entry[2] += nbytes
+
+def snapshot():
+    """Get a copy of the recorded stats ({stage: [count, seconds, bytes]})."""
+
+    with _lock:
+        return {name: list(entry) for name, entry in _stats.items()}
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+def merge(stats):
+    """Add stats recorded elsewhere (e.g. in a worker process, see ProfiledCall)."""
+
+    for name, (count, seconds, nbytes) in stats.items():
+        record(name, seconds, count, nbytes)
+
+class ProfiledCall(object):
+    """Wrap a function run in a worker process so that it also returns its stats.
+
+    Profiling is enabled in the worker whatever the start method of the pool, and
+    the stats of each call are returned with its result for the parent to merge.
+
+    Args:
+        func (callable): A picklable function taking one item.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, item):
+        if not _enabled:
+            enable()
+        reset()
+        result = self.func(item)
+        return result, snapshot()
+
+def summary(stats=None, wall=None):
+    """Format the stats as a table.
+
+    Args:
+        stats (dict, optional): The stats. Defaults to None (the recorded ones).
+        wall (float, optional): The wall time in seconds. Defaults to None (since enable).
+
+    Returns:
+        str: The table, with the stages sorted by time. The time of stages run in
+             worker processes is summed over the workers, so it can exceed the wall time.
+    """
+
+    stats = snapshot() if stats is None else stats
+    wall = time.perf_counter() - _start_time if wall is None else wall
+    lines = ['{0:<20} {1:>9} {2:>10} {3:>10} {4:>7} {5:>10} {6:>9}'.format(
+        'stage', 'count', 'total s', 'mean ms', 'wall %', 'MB', 'MB/s')]
+    for name, (count, seconds, nbytes) in sorted(stats.items(), key=lambda item: -item[1][1]):
+        mb = nbytes / (1 << 20)
+        lines.append('{0:<20} {1:>9} {2:>10.3f} {3:>10.3f} {4:>7.1f} {5:>10.1f} {6:>9}'.format(
+            name, count, seconds, 1000 * seconds / max(count, 1), 100 * seconds / max(wall, 1e-9),
+            mb, '{:.1f}'.format(mb / seconds) if nbytes and seconds > 0 else '-'))
+    lines.append('{0:<20} {1:>9} {2:>10.3f}'.format('wall', '', wall))
+    return '\n'.join(lines)
+
+def report(json_path):
+    """Print the summary table and write the stats as a JSON report.
+
+    Args:
+        json_path (str): The JSON report file.
+    """
+
+    wall = time.perf_counter() - _start_time
+    stats = snapshot()
+    print(summary(stats, wall))
+    if os.path.dirname(json_path) and not os.path.exists(os.path.dirname(json_path)):
+        os.makedirs(os.path.dirname(json_path))
+    with open(json_path, 'w') as f:
+        json.dump({'wall_seconds': wall,
+                   'stages': {name: {'count': count, 'seconds': seconds, 'bytes': nbytes}
+                              for name, (count, seconds, nbytes) in stats.items()}}, f, indent=2)
+    print('Profile saved to {}'.format(json_path))
@@ -0,0 +1,221 @@
+import functools
+import os
+import random
+
+from utils import profiler
+from utils.dataset import load_coco_index, parse_voc_xml
+from utils.general import parallel_imap
+from utils.image import open_thumbnail
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+cv2 = lazy_import('cv2')
+Image = lazy_import('PIL.Image')
+mask_utils = lazy_import('pycocotools.mask')
+
+def load_preview(img_path, max_size=None):
+    """Load an image for a preview, shrunk so that its longest side is at most max_size.
+
+    Args:
+        img_path (str): The image path.
+        max_size (int, optional): The maximum width and height. Defaults to None (original size).
+
+    Returns:
+        tuple: The RGB image (numpy.ndarray) and its scale relative to the original image.
+    """
+
+    with Image.open(img_path) as img:
+        width = img.size[0]
+    img_size = None if max_size is None else (max_size, max_size)
+    img = np.array(open_thumbnail(img_path, img_size).convert('RGB'))
+    return img, img.shape[1] / width
+
+def draw_boxes(img, objs):
+    """Draw the boxes and names of objects (in place).
+
+    Args:
+        img (numpy.ndarray): The RGB image.
+        objs (list): The objects as [name, xmin, ymin, xmax, ymax].
+
+    Returns:
+        numpy.ndarray: The image.
+    """
+
+    for obj in objs:
+        p1 = (obj[1], obj[2])
+        p2 = (obj[3], obj[4])
+        p3 = (max(obj[1], 15), max(obj[2], 15))
+        cv2.rectangle(img, p1, p2, (255, 0, 0), 2)
+        cv2.putText(img, obj[0], p3, cv2.FONT_ITALIC, 1, (0, 255, 0), 2)
+    return img
+
+def rle_preview_mask(rle, height, width):
+    """Decode a compressed RLE mask and resize it to the preview size."""
+
+    mask = mask_utils.decode(rle)
+    return cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST).astype(bool)
+
+def coco_ann_mask(ann, height, width, scale):
+    """Rasterize a coco annotation at the preview scale.
+
+    Only polygons of at least 3 points are rasterized: annotations without them (e.g. 
+    the labelme points of a circle, line or point written by labelme2coco) are drawn 
+    as their box.
+
+    Args:
+        ann (utils.dataset.CocoAnnotation): The annotation.
+        height (int): The preview height.
+        width (int): The preview width.
+        scale (float): The preview scale.
+
+    Returns:
+        numpy.ndarray: The boolean mask.
+    """
+
+    segmentation = ann.segmentation
+    if isinstance(segmentation, dict):
+        rle = segmentation
+        if isinstance(rle['counts'], list):
+            rle = mask_utils.frPyObjects(rle, *rle['size'])
+        return rle_preview_mask(rle, height, width)
+
+    polygons = [polygon for polygon in segmentation or [] if len(polygon) >= 6]
+    if not polygons:
+        x, y, w, h = ann.bbox
+        polygons = [[x, y, x + w, y, x + w, y + h, x, y + h]]
+    polygons = [(np.asarray(polygon, dtype=float) * scale).tolist() for polygon in polygons]
+    rle = mask_utils.merge(mask_utils.frPyObjects(polygons, height, width))
+    return mask_utils.decode(rle).astype(bool)
+
+def render_coco_image(task, categories, max_size=None):
+    """Render the preview of one coco image.
+
+    Args:
+        task (tuple): The image path, the save path, the annotations of the image and 
+                      their masks as compressed RLE (None to rasterize the annotations).
+        categories (dict): The category names by id.
+        max_size (int, optional): The maximum preview width and height. Defaults to None.
+
+    Returns:
+        str: The save path.
+    """
+
+    import imgviz
+
+    img_path, save_path, anns, rles = task
+    with profiler.stage('render_preview'):
+        img, scale = load_preview(img_path, max_size)
+        if len(anns) > 0:
+            height, width = img.shape[:2]
+            if rles is not None:
+                masks = [rle_preview_mask(rle, height, width) for rle in rles]
+            else:
+                masks = [coco_ann_mask(ann, height, width, scale) for ann in anns]
+            img = imgviz.instances2rgb(image=img,
+                                       labels=[ann.category_id for ann in anns],
+                                       masks=masks,
+                                       captions=[categories[ann.category_id] for ann in anns],
+                                       font_size=15,
+                                       line_width=2,)
+        Image.fromarray(img).save(save_path)
+    return save_path
+
+def render_voc_image(xml_path, img_dir, save_dir, max_size=None, prefix=''):
+    """Render the preview of one voc annotation file.
+
+    Args:
+        xml_path (str): The voc annotation file.
+        img_dir (str): The directory of images.
+        save_dir (str): The output directory of the previews.
+        max_size (int, optional): The maximum preview width and height. Defaults to None.
+        prefix (str, optional): The prefix of the preview file name. Defaults to ''.
+
+    Returns:
+        str: The save path.
+    """
+
+    voc = parse_voc_xml(xml_path)
+    with profiler.stage('render_preview'):
+        img, scale = load_preview(os.path.join(img_dir, voc['filename']), max_size)
+        objs = [[obj[0]] + [int(round(v * scale)) for v in obj[1:]] for obj in voc['objects']]
+        save_path = os.path.join(save_dir, prefix + voc['filename'])
+        Image.fromarray(draw_boxes(img, objs)).save(save_path)
+    return save_path
+
+def sample_tasks(tasks, num_samples=None, seed=0):
+    """Select a reproducible random subset of the tasks, keeping their order."""
+
+    if num_samples is None or num_samples >= len(tasks):
+        return tasks
+    indices = sorted(random.Random(seed).sample(range(len(tasks)), num_samples))
+    return [tasks[i] for i in indices]
+
+def visualize_coco(json_path, img_dir, save_dir, max_size=None, num_samples=None, seed=0,
+                   workers=1, prefix='', file_names=None, masks=None):
+    """Render previews of the images of a coco annotation file.
+
+    Args:
+        json_path (str): The coco annotation file (or a directory of shards).
+        img_dir (str): The directory the image file names are relative to.
+        save_dir (str): The output directory of the previews.
+        max_size (int, optional): The maximum preview width and height. Defaults to None
+                                  (original size).
+        num_samples (int, optional): Only render a random subset of this many images.
+                                     Defaults to None (all images).
+        seed (int, optional): The seed of the sampling. Defaults to 0.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        prefix (str, optional): The prefix of the preview file names. Defaults to ''.
+        file_names (set, optional): Only render these image file names. Defaults to None.
+        masks (dict, optional): The masks of the annotations of some images as compressed RLE 
+                                ({file_name: [rle]}, in the order of the annotations), drawn 
+                                instead of rasterizing the annotations. Defaults to None.
+
+    Returns:
+        list: The paths of the rendered previews.
+    """
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    images, categories, annotations = load_coco_index(json_path)
+    tasks = [(os.path.join(img_dir, file_name),
+              os.path.join(save_dir, prefix + os.path.basename(file_name)),
+              annotations.get(img_id, []),
+              None if masks is None else masks.get(file_name))
+             for img_id, (file_name, _, _) in images.items()
+             if file_names is None or file_name in file_names]
+    worker = functools.partial(render_coco_image, categories=categories, max_size=max_size)
+    return list(parallel_imap(worker, sample_tasks(tasks, num_samples, seed), workers))
+
+def visualize_voc(ann_dir, img_dir, save_dir, max_size=None, num_samples=None, seed=0, 
+                  workers=1, prefix='', xml_names=None):
+    """Render previews of the images of voc annotation files.
+
+    Args:
+        ann_dir (str): The directory of voc annotation files.
+        img_dir (str): The directory of images.
+        save_dir (str): The output directory of the previews.
+        max_size (int, optional): The maximum preview width and height. Defaults to None 
+                                  (original size).
+        num_samples (int, optional): Only render a random subset of this many images. 
+                                     Defaults to None (all images).
+        seed (int, optional): The seed of the sampling. Defaults to 0.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        prefix (str, optional): The prefix of the preview file names. Defaults to ''.
+        xml_names (list, optional): Only render these annotation files. Defaults to None 
+                                    (all the files in ann_dir).
+
+    Returns:
+        list: The paths of the rendered previews.
+    """
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    if xml_names is None:
+        xml_names = sorted(name for name in os.listdir(ann_dir) if name.endswith('.xml'))
+    xml_paths = [os.path.join(ann_dir, xml_name) for xml_name in xml_names]
+    worker = functools.partial(render_voc_image, 
+                               img_dir=img_dir, 
+                               save_dir=save_dir, 
+                               max_size=max_size, 
+                               prefix=prefix)
+    return list(parallel_imap(worker, sample_tasks(xml_paths, num_samples, seed), workers))